@@ -0,0 +1,124 @@
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from github_client import get_github_client
+from sqlite_store import SQLiteStore, SharedInstance
+
+# Defaults for attachment downloads, can be overridden from the environment
+DEFAULT_MAX_BYTES = int(float(os.getenv('ATTACHMENT_MAX_MB', 20)) * 1024 * 1024)
+DEFAULT_WORKERS = int(os.getenv('ATTACHMENT_CONCURRENCY', 8))
+CHUNK_SIZE = 64 * 1024
+
+
+# Content-addressed store for issue attachments, files are named by the sha256 of their content
+# the URL of every stored file is kept in a SQLite table, so already downloaded attachments are not fetched again
+# and processes documenting issues at the same time, like the web app and a backfill, share what they downloaded
+class AttachmentStore(SQLiteStore):
+    def __init__(self, output_dir='downloads', max_bytes=DEFAULT_MAX_BYTES, max_workers=DEFAULT_WORKERS):
+        super().__init__(os.path.join(output_dir, 'index.sqlite'), """
+            CREATE TABLE IF NOT EXISTS attachments (
+                url TEXT PRIMARY KEY,
+                path TEXT NOT NULL
+            );
+        """)
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        # The index was kept in a JSON file before, it is imported once and renamed
+        legacy_path = os.path.join(output_dir, 'index.json')
+        if os.path.exists(legacy_path):
+            self.import_json(legacy_path)
+
+    # Method to download one attachment, returns the local path or None when it could not be stored
+    def download(self, url):
+        return self._fetch(url)
+
+    # Method to download many attachments concurrently, returns a dict of URL to local path
+    def download_all(self, urls):
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            paths = list(executor.map(self._fetch, urls))
+        return dict(zip(urls, paths))
+
+    # Method to import the URLs of the former JSON index, the file is renamed once imported
+    def import_json(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        with self.lock:
+            self.connection.executemany('INSERT OR IGNORE INTO attachments (url, path) VALUES (?, ?)', list(index.items()))
+            self.connection.commit()
+        os.replace(path, f'{path}.imported')
+        print(f"Imported {len(index)} attachments from {path}")
+
+    def _fetch(self, url):
+        with self.lock:
+            row = self.connection.execute('SELECT path FROM attachments WHERE url = ?', (url,)).fetchone()
+        known_path = row[0] if row else None
+        if known_path and os.path.exists(known_path):
+            return known_path
+
+        # Attachments live on other hosts, use an unauthenticated pool for that host
+        client = get_github_client(None, urlparse(url).netloc)
+        try:
+            with client.get(url, stream=True) as r:
+                r.raise_for_status()
+                if int(r.headers.get('Content-Length') or 0) > self.max_bytes:
+                    print(f'Skipping {url}, it is larger than {self.max_bytes} bytes')
+                    return None
+                local_path = self._store_stream(url, r)
+        except Exception as e:
+            print(f'Could not download {url}: {e}')
+            return None
+
+        if local_path:
+            with self.lock:
+                self.connection.execute('INSERT OR REPLACE INTO attachments (url, path) VALUES (?, ?)', (url, local_path))
+                self.connection.commit()
+        return local_path
+
+    # Method to stream a response into a temporary file while hashing it, then move it to its content address
+    def _store_stream(self, url, response):
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.output_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        print(f'Skipping {url}, it is larger than {self.max_bytes} bytes')
+                        return None
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            local_path = os.path.join(self.output_dir, digest.hexdigest() + self._extension(url, response))
+            if os.path.exists(local_path):
+                # Same content already stored, e.g. the same screenshot posted twice
+                return local_path
+            os.replace(temp_path, local_path)
+            return local_path
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def _extension(url, response):
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension and len(extension) <= 5:
+            return extension
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        return mimetypes.guess_extension(content_type) or ''
+
+
+# Shared store, opened on first use
+_store = SharedInstance(AttachmentStore)
+
+
+def get_attachment_store():
+    return _store.get()
@@ -0,0 +1,102 @@
+# Command to document and embed the full issue history of the maintenance and release repositories
+# progress is checkpointed after every page, so an interrupted run resumes where it stopped
+#
+# Usage: python backfill.py [--repo maintenance|release|<name>] [--batch-size 25] [--restart] [--reindex]
+import argparse
+import json
+import os
+import time
+from dotenv import load_dotenv
+from issue_documenter import ISSUE_BATCH_SIZE, IssueDocumenter
+from rate_limiter import bulk_priority
+
+CHECKPOINT_DIR = 'data'
+
+
+# Remembers the cursor after the last documented page of a repository
+class BackfillCheckpoint:
+    def __init__(self, repo_owner, repo_name, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f'backfill_{repo_owner}_{repo_name}.json')
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {'cursor': None, 'documented': 0, 'completed': False}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, checkpoint):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Function to document every issue of a repository, oldest first, one page at a time
+# with reindex every document is written to the vector database and the search indexes again, even when its content did not change
+def backfill_repository(github_token, repo_owner, repo_name, batch_size=ISSUE_BATCH_SIZE, restart=False, reindex=False):
+    checkpoint_store = BackfillCheckpoint(repo_owner, repo_name)
+    if restart:
+        checkpoint_store.clear()
+    checkpoint = checkpoint_store.load()
+    if reindex and not (checkpoint.get('reindex') and not checkpoint['completed']):
+        # A reindex goes over every issue again, only an interrupted reindex is resumed
+        checkpoint = {'cursor': None, 'documented': 0, 'completed': False, 'reindex': True}
+    if checkpoint['completed']:
+        print(f"{repo_owner}/{repo_name} was already backfilled, use --restart to run it again or --reindex to index every document again")
+        return checkpoint['documented']
+    if checkpoint['cursor']:
+        print(f"Resuming {'reindex' if checkpoint.get('reindex') else 'backfill'} of {repo_owner}/{repo_name} after {checkpoint['documented']} issues")
+
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    started_at = time.monotonic()
+    documented = 0
+    # Background work, leave rate limit budget to interactive requests
+    with bulk_priority():
+        for page, cursor, total in documenter.iter_repository_issue_pages(checkpoint['cursor'], batch_size):
+            # Only one page of issues and comments is held in memory at a time
+            documenter.document_fetched_issues(page, reindex=checkpoint.get('reindex', False))
+            documented += len(page)
+            checkpoint['cursor'] = cursor
+            checkpoint['documented'] += len(page)
+            checkpoint_store.save(checkpoint)
+
+            elapsed = time.monotonic() - started_at
+            rate = documented / elapsed * 60 if elapsed else 0
+            print(f"{repo_owner}/{repo_name}: {checkpoint['documented']}/{total} issues, {rate:.1f} issues/min")
+
+    checkpoint['completed'] = True
+    checkpoint_store.save(checkpoint)
+    elapsed = time.monotonic() - started_at
+    print(f"Backfilled {documented} issues of {repo_owner}/{repo_name} in {elapsed:.0f}s")
+    return checkpoint['documented']
+
+
+def main():
+    load_dotenv()
+    repos = {
+        'maintenance': os.getenv('MAINTENANCE_REPO'),
+        'release': os.getenv('RELEASE_REPO')
+    }
+    parser = argparse.ArgumentParser(description='Document and embed the full issue history of a repository')
+    parser.add_argument('--repo', action='append', help='maintenance, release or a repository name, defaults to both maintenance and release')
+    parser.add_argument('--batch-size', type=int, default=ISSUE_BATCH_SIZE, help='issues fetched and embedded per page')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the oldest issue')
+    parser.add_argument('--reindex', action='store_true', help='index every document again, e.g. to add the metadata of a newer version to older entries')
+    args = parser.parse_args()
+
+    github_token = os.getenv('GITHUB_TOKEN')
+    repo_owner = os.getenv('REPO_OWNER')
+    repo_names = [repos.get(repo, repo) for repo in args.repo] if args.repo else [name for name in repos.values() if name]
+    if not repo_names:
+        raise Exception('No repository to backfill, set MAINTENANCE_REPO and RELEASE_REPO or pass --repo')
+    for repo_name in repo_names:
+        backfill_repository(github_token, repo_owner, repo_name, args.batch_size, args.restart, args.reindex)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Benchmark of the startup cost of every entry point, measured with python -X importtime
+# each module is imported in a fresh interpreter, the report lists its total import time and its slowest imports
+#
+# Usage: python benchmarks/bench_import_time.py --repeat 5 --top 10
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by the entry points, web_app is left out since importing it starts the server
+ENTRY_POINTS = ['main', 'backfill', 'issue_documenter', 'webhook_worker', 'vector_database', 'content_generator', 'code_assistant']
+
+
+# Function to import a module in a fresh interpreter
+# returns the cumulative import time of the module and of each package it imports directly, in milliseconds
+def import_times(module):
+    # Console mode keeps main from importing and starting the web application
+    env = dict(os.environ, USE_CONSOLE='True')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise Exception(f'could not be imported: {result.stderr.strip().splitlines()[-1]}')
+    # A package is reported once its own imports are done, two spaces deeper than the package importing it
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name == module:
+                return int(cumulative) / 1000, children
+            children = {}
+    raise Exception('was not found in the import time report')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the import time of the entry points')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help='modules to import, defaults to every entry point')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh imports per module, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='slowest direct imports listed per module')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            runs = [import_times(module) for _ in range(args.repeat)]
+        except Exception as e:
+            print(f"{module:<20} {e}")
+            continue
+        print(f"{module:<20} {statistics.median(total for total, _ in runs):8.1f} ms")
+        packages = {name: statistics.median(children.get(name, 0) for _, children in runs) for name in runs[0][1]}
+        for name, elapsed in sorted(packages.items(), key=lambda entry: entry[1], reverse=True)[:args.top]:
+            print(f"    {name:<36} {elapsed:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Benchmark of the issue markdown builder over large synthetic comment threads
+# compares the previous builder (HTML parsing of every comment, the document joined three times)
+# with the streaming builder used by IssueDocumenter.document_issue
+#
+# Usage: python benchmarks/bench_markdown_builder.py --comments 300 --lines 2000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_issue(comments, lines, tag_ratio):
+    random.seed(42)
+    issue = {
+        'number': 1,
+        'title': 'Synthetic issue',
+        'user': {'login': 'author'},
+        'created_at': '2024-01-01T00:00:00Z',
+        'updated_at': '2024-01-02T00:00:00Z',
+        'state': 'open',
+        'labels': [{'name': 'bug'}],
+        'body': 'Crash when opening the app',
+    }
+    thread = []
+    for i in range(comments):
+        log = '\n'.join(f'2024-01-01 00:00:{j % 60:02d} ERROR worker-{j % 8} failed to process item {j}' for j in range(lines))
+        if random.random() < tag_ratio:
+            log += f'\n<img src="https://example.com/screenshot_{i}.png">\n<a href="https://example.com/log_{i}">full log</a>'
+        thread.append({
+            'id': i,
+            'user': {'login': f'user{i % 5}'},
+            'created_at': '2024-01-01T00:00:00Z',
+            'updated_at': '2024-01-01T00:00:00Z',
+            'body': log,
+        })
+    return issue, thread
+
+
+# The builder as it was before streaming, kept here as the baseline
+def previous_builder(issue, comments, downloaded):
+    from bs4 import BeautifulSoup
+    document_content = []
+    document_content.append(f"# Issue #{issue['number']}: {issue['title']}\n")
+    document_content.append(f"**Author:** {issue['user']['login']}\n")
+    document_content.append(f"**Date:** {issue['created_at']}\n")
+    document_content.append(f"**Status:** {issue['state']}\n")
+    document_content.append(f"**Labels:** {', '.join(label['name'] for label in issue['labels'])}\n\n")
+    document_content.append(f"## Description\n")
+    document_content.append(f"{issue['body']}\n")
+    document_content.append(f"-------------------------------------\n")
+    document_content.append(f"## Comments\n")
+    for comment in comments:
+        soup = BeautifulSoup(comment['body'], 'html.parser')
+        document_content.append(f"### Comment by {comment['user']['login']}\n")
+        document_content.append(f"**Date:** {comment['created_at']}\n\n")
+        comment_lines = comment['body'].split('\n')
+        blockquoted_comment = '\n'.join(f'> {line}' for line in comment_lines if line.strip() != '')
+        document_content.append(blockquoted_comment + '\n')
+        for img in soup.find_all('img'):
+            document_content.append(f"![Downloaded image]({downloaded(img['src'])})\n")
+        for link in soup.find_all('a'):
+            link_url = link['href']
+            if link_url.endswith(('.jpg', '.jpeg', '.png', '.gif')):
+                document_content.append(f"![Downloaded file]({downloaded(link_url)})\n")
+            else:
+                document_content.append(f"[Link]({link_url})\n")
+        document_content.append(f"\n-------------------------\n")
+
+    # The file, the vector database entry and the return value each joined the document
+    with open('issues/issue_1_documentation.md', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(document_content))
+    database_document = '\n'.join(document_content)
+    return '\n'.join(document_content)
+
+
+def measure(name, build, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        content = build()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} best {min(timings) * 1000:8.1f} ms   mean {sum(timings) / len(timings) * 1000:8.1f} ms   peak memory {peak / 1024 / 1024:7.1f} MB")
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the issue markdown builder')
+    parser.add_argument('--comments', type=int, default=300, help='comments in the synthetic thread')
+    parser.add_argument('--lines', type=int, default=2000, help='log lines pasted in every comment')
+    parser.add_argument('--tag-ratio', type=float, default=0.1, help='share of comments with an image and a link tag')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    issue, comments = make_issue(args.comments, args.lines, args.tag_ratio)
+    size = sum(len(comment['body']) for comment in comments)
+    print(f"{args.comments} comments, {size / 1024 / 1024:.1f} MB of comment text")
+
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs('issues')
+    from issue_documenter import IssueDocumenter
+    documenter = IssueDocumenter('token', 'owner', 'repo', 1)
+    # No network, every attachment resolves to the same local file
+    stub_path = os.path.join('downloads', 'stub.png')
+    documenter.attachments.download_all = lambda urls: {url: stub_path for url in urls}
+
+    previous = measure('previous', lambda: previous_builder(issue, comments, lambda url: stub_path), args.repeat)
+    streaming = measure('streaming', lambda: documenter.write_issue_document(1, documenter.iter_issue_document(issue, comments)), args.repeat)
+    print('documents match' if previous == streaming else 'documents differ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Benchmark of the search backends of VectorDatabase over synthetic embeddings
+# reports recall@k against a brute force ground truth and the p50/p99 latency of single queries,
+# for the exact backend and for the HNSW index of Chroma with every combination of M and search ef
+#
+# Usage: python benchmarks/bench_vector_search.py --sizes 1000 10000 50000 --M 16 32 --ef 10 50 100
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The synthetic entries come with their embeddings, nothing is embedded or cached
+os.environ['EMBEDDING_CACHE'] = 'false'
+
+from vector_database import VectorDatabase
+
+
+# Function to draw normalized embeddings grouped around topics, like the chunks of related issues
+def make_embeddings(count, dimension, topics, random):
+    centers = random.standard_normal((topics, dimension)).astype(np.float32)
+    vectors = centers[random.randint(0, topics, count)] + 0.6 * random.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# Function to get the ids of the k nearest embeddings of every query, by brute force
+def ground_truth(embeddings, queries, k):
+    distances = -queries @ embeddings.T
+    nearest = np.argsort(distances, axis=1)[:, :k]
+    return [{f"doc{index}" for index in row} for row in nearest]
+
+
+# Function to fill a new collection and time every query on its own, the way the issue documenter queries
+# returns the recall@k, the p50 and p99 latency in milliseconds and the seconds spent filling the collection
+def run(embeddings, queries, truth, k, **params):
+    with tempfile.TemporaryDirectory() as directory:
+        started_at = time.perf_counter()
+        # Large batches keep the time spent writing close to what a backfill sees
+        database = VectorDatabase(persist_directory=directory, batch_size=5000, **params)
+        database.upsert_documents([
+            {"id": f"doc{index}", "document": f"document {index}", "metadata": {"index": index}, "embedding": embedding.tolist()}
+            for index, embedding in enumerate(embeddings)
+        ])
+        # The exact index reads the collection on its first query
+        database.query_documents_batch(query_embeddings=[queries[0].tolist()], n_results=k)
+        build_seconds = time.perf_counter() - started_at
+
+        latencies = []
+        found = 0
+        for query, expected in zip(queries, truth):
+            started_at = time.perf_counter()
+            hits = database.query_documents_batch(query_embeddings=[query.tolist()], n_results=k)[0]
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            found += len(expected & {hit['id'] for hit in hits})
+        database.client.clear_system_cache()
+    return found / (k * len(queries)), np.percentile(latencies, 50), np.percentile(latencies, 99), build_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the exact and HNSW search backends of the vector database')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='entries in the collection')
+    parser.add_argument('--dim', type=int, default=384, help='dimension of the embeddings, 384 like the default embedding model')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--M', type=int, nargs='+', default=[16, 32], help='HNSW graph degrees')
+    parser.add_argument('--ef', type=int, nargs='+', default=[10, 50, 100], help='HNSW search ef values')
+    parser.add_argument('--construction-ef', type=int, default=100)
+    parser.add_argument('--topics', type=int, default=50, help='clusters of the synthetic embeddings')
+    args = parser.parse_args()
+
+    random = np.random.RandomState(42)
+    print(f"{'size':>8} {'backend':<24} {'recall@' + str(args.k):>10} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9}")
+    for size in args.sizes:
+        embeddings = make_embeddings(size, args.dim, args.topics, random)
+        queries = make_embeddings(args.queries, args.dim, args.topics, random)
+        truth = ground_truth(embeddings, queries, args.k)
+
+        configurations = [('exact', {"search_backend": 'exact'})]
+        for m in args.M:
+            for ef in args.ef:
+                configurations.append((f'hnsw M={m} ef={ef}', {
+                    "search_backend": 'hnsw',
+                    "hnsw_params": {"M": m, "search_ef": ef, "construction_ef": args.construction_ef}
+                }))
+        for name, params in configurations:
+            recall, p50, p99, build_seconds = run(embeddings, queries, truth, args.k, **params)
+            print(f"{size:>8} {name:<24} {recall:>10.3f} {p50:>9.2f} {p99:>9.2f} {build_seconds:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
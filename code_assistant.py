@@ -1,16 +1,8 @@
-from langchain_community.document_loaders import DirectoryLoader
-from langchain_community.document_loaders import TextLoader
-from langchain_community.tools.shell.tool import ShellTool
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import AgentExecutor
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+# The document loaders, the shell tool, the model and the agent are imported when first used, they are slow to import
 from langchain.tools import tool
-from langchain.agents.format_scratchpad.openai_tools import (
-    format_to_openai_tool_messages,
-)
-from langchain_openai import ChatOpenAI
 #from prompt import *
-from issue_documenter import add_comment_to_issue, create_or_update_release, delete_tag, document_github_issue, get_similar_issues, list_all_releases, list_github_issues, search_issues
+from issue_documenter import add_comment_to_issue, count_github_issues_by_status, create_or_update_release, delete_tag, document_github_issue, document_github_issues_batch, get_likely_duplicates, get_similar_issues, get_similar_issues_batch, list_all_releases, list_github_issues, search_issue_documents, search_issues
+from issue_files import issue_document_path
 from git_files_comparer import compare_files_between_commits
 from content_generator import  extract_issue_information, generate_release_table, generate_release_notes, generate_release_notes_for_issue, prepare_release_notes 
 import os
@@ -25,6 +17,7 @@ def look_at_existing_app():
     Returns:
         list: A list of file names present in the 'app' directory.
     """
+    from langchain_community.document_loaders import DirectoryLoader
     code = DirectoryLoader(f"./app/", silent_errors=True).load()
     return [c.metadata["source"] for c in code]
 
@@ -52,6 +45,7 @@ def get_page_contents(files):
     Returns:
         list: A list of formatted strings containing the file names and their contents.
     """
+    from langchain_community.document_loaders import TextLoader
     loader = TextLoader(files[0])
     return [f"___{doc.metadata['source']}___\n{doc.page_content}" for doc in loader.load()]
     directory = 'issues'
@@ -63,6 +57,7 @@ def generate_unit_tests(function_code):
     """
     Generates the unit tests using OpenAI and `unittest` python library.
     """
+    from langchain_openai import ChatOpenAI
     model_name = os.getenv('GPT_MODEL_NAME')
     llm = ChatOpenAI(
         model_name=model_name,
@@ -111,7 +106,7 @@ def create_new_file(filename: str):
 @tool
 def document_github_issue_tool(issue_id: int, repo: str):
     """Use this to download all information about a GitHub issue
-    The information will be saved in the file issues/issue_<issue_id>_documentation.md
+    The information will be saved in the file issues/<owner>/<repo>/issue_<issue_id>_documentation.md
     repo is the name of the GitHub repository:
     'maintenance' for maintenance issues
     'release' for issues related to product releases
@@ -128,14 +123,16 @@ def list_all_releases_tool():
     return list_all_releases()
 
 @tool
-def get_similar_issues_tool(issue_number: int, repo_name: str):
+def get_similar_issues_tool(issue_number: int, repo_name: str, state: str = None):
     """Use this to get a list of similar issues to the one provided.
     Args:
         issue_number (int): _description_
         repo_name (str): _description_
+        state (str): _description_
     repo_name is the name of the repository where the issue is located:
     'maintenance' for maintenance issues
     'release' for issues related to product releases
+    state limits the similar issues to 'open' or 'closed' ones, leave it empty to search all of them
     Returns:
         _type_: _description_
     """
@@ -143,7 +140,65 @@ def get_similar_issues_tool(issue_number: int, repo_name: str):
         repo_name = os.getenv('MAINTENANCE_REPO')
     else:
         repo_name = os.getenv('RELEASE_REPO')
-    return get_similar_issues(issue_number, repo_name)
+    return get_similar_issues(issue_number, repo_name, state)
+
+@tool
+def search_issue_documents_tool(query: str, repo_name: str, mode: str = 'hybrid'):
+    """Use this to find documented issues mentioning a text, e.g. to check if a crash, an error code or a stack trace was reported before.
+    Args:
+        query (str): _description_
+        repo_name (str): _description_
+        mode (str): _description_
+    repo_name is the name of the repository where the issues are located:
+    'maintenance' for maintenance issues
+    'release' for issues related to product releases
+    mode is 'lexical' to match the exact words, 'vector' to match the meaning or 'hybrid' to combine both
+    Returns:
+        _type_: _description_
+    """
+    if repo_name == 'maintenance':
+        repo_name = os.getenv('MAINTENANCE_REPO')
+    else:
+        repo_name = os.getenv('RELEASE_REPO')
+    return search_issue_documents(query, repo_name, mode)
+
+@tool
+def get_likely_duplicates_tool(issue_number: int, repo_name: str):
+    """Use this first to check if an issue is a duplicate of another one, it finds issues with nearly the same title and description.
+    Args:
+        issue_number (int): _description_
+        repo_name (str): _description_
+    repo_name is the name of the repository where the issue is located:
+    'maintenance' for maintenance issues
+    'release' for issues related to product releases
+    Returns:
+        _type_: _description_
+    """
+    if repo_name == 'maintenance':
+        repo_name = os.getenv('MAINTENANCE_REPO')
+    else:
+        repo_name = os.getenv('RELEASE_REPO')
+    return get_likely_duplicates(issue_number, repo_name)
+
+@tool
+def get_similar_issues_batch_tool(issue_numbers: list, repo_name: str, state: str = None):
+    """Use this to get the similar issues of several issues at once, e.g. when evaluating a list of new issues.
+    Args:
+        issue_numbers (list): _description_
+        repo_name (str): _description_
+        state (str): _description_
+    repo_name is the name of the repository where the issues are located:
+    'maintenance' for maintenance issues
+    'release' for issues related to product releases
+    state limits the similar issues to 'open' or 'closed' ones, leave it empty to search all of them
+    Returns:
+        _type_: _description_
+    """
+    if repo_name == 'maintenance':
+        repo_name = os.getenv('MAINTENANCE_REPO')
+    else:
+        repo_name = os.getenv('RELEASE_REPO')
+    return get_similar_issues_batch(issue_numbers, repo_name, state)
 
 @tool
 def list_release_line_issues(product: str=None, status: str='open'):
@@ -209,16 +264,33 @@ def list_github_issues_tool(project_number: int, status: str= None, product: str
     return list_github_issues(project_number, status, product)
 
 
+# Document, in batched requests, the issues that don't have a documentation file yet
+def document_missing_issues(issue_numbers):
+    repo_owner = os.getenv('REPO_OWNER')
+    repo_name = os.getenv('REPO_NAME')
+    missing = [issue_number for issue_number in issue_numbers if not os.path.exists(issue_document_path(repo_owner, repo_name, issue_number))]
+    if missing:
+        document_github_issues_batch(missing)
+
+
+@tool
+def count_github_issues_by_status_tool(project_number: int):
+    """Use this to know how many GitHub issues are in each status of a project board.
+       Please specify the project number.
+       Returns a dictionary with the board status as key and the number of issues as value.
+    """
+    return count_github_issues_by_status(project_number)
+
+
 @tool
 def generate_release_table_tool(issue_numbers: list[int]):
     """Use this too to generate a table with the information of the issues included in the release we are preparing 
     pass a list with the GitHub issues id, for the release we should consider only the issues in the Pending Release state
     """
     issue_info = { }
+    document_missing_issues(issue_numbers)
     for issue_number in issue_numbers:
         #issue_notes[issue_number] = generate_release_notes_for_issue(issue_number)
-        if not os.path.exists(f'issues/issue_{issue_number}_documentation.md'):
-            document_github_issue(issue_number)
         issue_info[issue_number] = extract_issue_information(issue_number)
 
     result = generate_release_table(issue_info)
@@ -233,9 +305,8 @@ def generate_release_notes_for_issue_tool(issue_numbers: list[int], product=''):
     product is the name of the product that is being released: maintenance
     """
     issue_notes = { }
+    document_missing_issues(issue_numbers)
     for issue_number in issue_numbers:
-        if not os.path.exists(f'issues/issue_{issue_number}_documentation.md'):
-            document_github_issue(issue_number)
         issue_notes[issue_number] = generate_release_notes_for_issue(issue_number)
 
     return issue_notes
@@ -327,6 +398,15 @@ def start_agent():
 
 agent_executor = None
 def initialize_agent():
+    from langchain_community.tools.shell.tool import ShellTool
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.agents import AgentExecutor
+    from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+    from langchain.agents.format_scratchpad.openai_tools import (
+        format_to_openai_tool_messages,
+    )
+    from langchain_openai import ChatOpenAI
+
     # List of tools to use
     tools = [
         ShellTool(ask_human_input=True),
@@ -337,11 +417,15 @@ def initialize_agent():
         update_file,
         document_github_issue_tool,
         list_github_issues_tool,
+        count_github_issues_by_status_tool,
         delete_tag_tool,
         add_comment_to_issue_tool,
         #list_release_line_issues,
         list_all_releases_tool,
+        get_likely_duplicates_tool,
         get_similar_issues_tool,
+        get_similar_issues_batch_tool,
+        search_issue_documents_tool,
         compare_files_between_commits_tool,
         generate_release_table_tool,
         generate_release_notes_for_issue_tool,
@@ -1,16 +1,20 @@
 from datetime import datetime
-from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
 from issue_documenter import IssueDocumenter
+from issue_files import issue_document_path
 from dotenv import load_dotenv
 import os
 
 model_name = os.getenv('GPT_MODEL_NAME')
 
+# Function to import the LangChain components of the generation chains on first use, they are slow to import
+def load_chain_components():
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+    from langchain_core.output_parsers import StrOutputParser
+    return ChatOpenAI, ChatPromptTemplate, StrOutputParser
+
 def generate_release_table(issues):
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
     release_brief_template = open('prompts/release_table.md').read()
     prompt = ChatPromptTemplate.from_template(release_brief_template)
@@ -24,6 +28,7 @@ def generate_release_table(issues):
 
 
 def generate_release_brief(issue_notes):
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
     release_brief_template = open('prompts/release_brief.md').read()
     prompt = ChatPromptTemplate.from_template(release_brief_template)
@@ -37,6 +42,7 @@ def generate_release_brief(issue_notes):
 
 def extract_issue_information(issue_number):
     # Set up the OpenAI LLM
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
     release_notes_template = open('prompts/extract_issue_information.md').read()
 
@@ -45,9 +51,10 @@ def extract_issue_information(issue_number):
     chain = prompt | llm | output_parser
 
     #check if file exists
-    if not os.path.exists(f'issues/issue_{issue_number}_documentation.md'):
+    document_path = issue_document_path(os.getenv('REPO_OWNER'), os.getenv('REPO_NAME'), issue_number)
+    if not os.path.exists(document_path):
         raise Exception(f'document for issue {issue_number} does not exist yet')
-    issue_info = open(f'issues/issue_{issue_number}_documentation.md', encoding='utf-8').read()
+    issue_info = open(document_path, encoding='utf-8').read()
 
     result = chain.invoke({
         "issue_content": issue_info
@@ -58,6 +65,7 @@ def extract_issue_information(issue_number):
 def generate_release_notes_for_issue(issue_number):
     # Set up the OpenAI LLM
     model_name = os.getenv('GPT_MODEL_NAME')
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
 
 
@@ -99,6 +107,7 @@ def generate_release_notes(build_tag, issue_numbers, release_issue_number, issue
     #release_notes_template = open('prompts/release_notes.md').read()
 
     # Set up the OpenAI LLM
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
 
     prompt = ChatPromptTemplate.from_template(release_notes_template)
@@ -163,6 +172,7 @@ def prepare_verification_notes(build_tag, issue_numbers, release_date, release_i
 
 def extract_issue_information_verification(issue_number):
     # Set up the OpenAI LLM
+    ChatOpenAI, ChatPromptTemplate, StrOutputParser = load_chain_components()
     llm = ChatOpenAI(model=model_name, temperature=0)
     release_notes_template = open('prompts/verification.md').read()
 
@@ -170,7 +180,7 @@ def extract_issue_information_verification(issue_number):
     output_parser = StrOutputParser()
     chain = prompt | llm | output_parser
 
-    issue_info = open(f'issues/issue_{issue_number}_documentation.md', encoding='utf-8').read()
+    issue_info = open(issue_document_path(os.getenv('REPO_OWNER'), os.getenv('REPO_NAME'), issue_number), encoding='utf-8').read()
 
     result = chain.invoke({
         "issue_info": issue_info
@@ -0,0 +1,146 @@
+import argparse
+import os
+import re
+import mmh3
+import numpy as np
+from issue_files import ISSUES_DIRECTORY, issue_doc_id, issue_report_text, iter_issue_document_files
+from sqlite_store import SQLiteStore, SharedInstance
+
+DEFAULT_INDEX_PATH = os.getenv('DUPLICATE_INDEX_PATH', os.path.join('data', 'duplicate_index.sqlite'))
+# Estimated Jaccard similarity from which two issues are reported as likely duplicates
+DEFAULT_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.5))
+# Words per shingle
+SHINGLE_SIZE = 3
+# 32 bands of 4 rows, issues sharing about 40% of their shingles or more land in the same bucket of at least one band
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+
+# Universal hashing (a * x + b) mod p turns the 32 bit hash of a shingle into one hash per permutation
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+_random = np.random.RandomState(1)
+PERM_A = _random.randint(1, MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _random.randint(0, MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+# Function to get the MinHash signature of a text, built from its lowercased word shingles
+def minhash_signature(text):
+    words = re.findall(r'\w+', text.lower())
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.array([mmh3.hash(shingle, signed=False) for shingle in shingles], dtype=np.uint64)
+    # One row per shingle and one column per permutation, the signature keeps the minimum of every column
+    permuted = (np.outer(hashes, PERM_A) + PERM_B) % MERSENNE_PRIME & MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+# Function to get the bucket of every band of a signature
+def band_buckets(signature):
+    return [mmh3.hash64(signature[band * ROWS:(band + 1) * ROWS].tobytes())[0] for band in range(BANDS)]
+
+
+# Near-duplicate index of issue texts, MinHash signatures with locality sensitive hashing over bands
+# finding candidates only reads the buckets of the query, no embedding is computed
+class DuplicateIndex(SQLiteStore):
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS signatures (
+                doc_id TEXT PRIMARY KEY,
+                repo TEXT,
+                issue_number INTEGER,
+                signature BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                doc_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket);
+            CREATE INDEX IF NOT EXISTS buckets_doc_id ON buckets (doc_id);
+        """)
+
+    # Method to insert or replace the signatures of documents, each a dict with id, text and metadata
+    def upsert_documents(self, docs):
+        entries = [(doc, minhash_signature(doc['text'])) for doc in docs]
+        with self.lock:
+            for doc, signature in entries:
+                self.connection.execute('DELETE FROM buckets WHERE doc_id = ?', (doc['id'],))
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO signatures (doc_id, repo, issue_number, signature) VALUES (?, ?, ?, ?)',
+                    (doc['id'], doc['metadata'].get('repo'), doc['metadata'].get('issue_number'), signature.tobytes())
+                )
+                self.connection.executemany(
+                    'INSERT INTO buckets (band, bucket, doc_id) VALUES (?, ?, ?)',
+                    [(band, bucket, doc['id']) for band, bucket in enumerate(band_buckets(signature))]
+                )
+            self.connection.commit()
+
+    def delete_documents(self, doc_ids):
+        with self.lock:
+            for doc_id in doc_ids:
+                self.connection.execute('DELETE FROM buckets WHERE doc_id = ?', (doc_id,))
+                self.connection.execute('DELETE FROM signatures WHERE doc_id = ?', (doc_id,))
+            self.connection.commit()
+
+    # Method to add the saved issue documents to the index, e.g. documents saved before the index existed
+    def index_directory(self, directory=ISSUES_DIRECTORY):
+        indexed = 0
+        for repo_owner, repo_name, issue_number, path in iter_issue_document_files(directory):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            self.upsert_documents([{
+                "id": issue_doc_id(repo_owner, repo_name, issue_number),
+                "text": issue_report_text(content),
+                "metadata": {"repo": f"{repo_owner}/{repo_name}", "issue_number": issue_number}
+            }])
+            indexed += 1
+        return indexed
+
+    # Method to get the stored signature of a document, returns None when it is not indexed
+    def get_signature(self, doc_id, repo=None):
+        with self.lock:
+            row = self.connection.execute('SELECT signature, repo FROM signatures WHERE doc_id = ?', (doc_id,)).fetchone()
+        if row is None or (repo and row[1] != repo):
+            return None
+        return np.frombuffer(row[0], dtype=np.uint32)
+
+    # Method to find the documents whose estimated Jaccard similarity with a signature reaches the threshold, most similar first
+    def find_duplicates(self, signature, repo=None, threshold=DEFAULT_THRESHOLD, exclude_id=None, n_results=5):
+        buckets = band_buckets(signature)
+        with self.lock:
+            candidate_ids = {row[0] for row in self.connection.execute(
+                f'SELECT DISTINCT doc_id FROM buckets WHERE {" OR ".join("(band = ? AND bucket = ?)" for _ in buckets)}',
+                [value for band, bucket in enumerate(buckets) for value in (band, bucket)]
+            )}
+            candidate_ids.discard(exclude_id)
+            if not candidate_ids:
+                return []
+            rows = self.connection.execute(
+                f'SELECT doc_id, repo, issue_number, signature FROM signatures WHERE doc_id IN ({", ".join("?" for _ in candidate_ids)})',
+                list(candidate_ids)
+            ).fetchall()
+
+        results = []
+        for doc_id, doc_repo, issue_number, candidate in rows:
+            if repo and doc_repo != repo:
+                continue
+            similarity = float(np.mean(np.frombuffer(candidate, dtype=np.uint32) == signature))
+            if similarity >= threshold:
+                results.append({"id": doc_id, "repo": doc_repo, "issue_number": issue_number, "similarity": similarity})
+        results.sort(key=lambda result: result['similarity'], reverse=True)
+        return results[:n_results]
+
+
+# Shared index, opened on first use
+_index = SharedInstance(DuplicateIndex)
+
+
+def get_duplicate_index():
+    return _index.get()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add the saved issue documents to the duplicate index')
+    parser.add_argument('--directory', default=ISSUES_DIRECTORY, help='folder with one subfolder per repository owner and name')
+    args = parser.parse_args()
+    print(f"Indexed {get_duplicate_index().index_directory(args.directory)} documents")
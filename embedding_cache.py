@@ -0,0 +1,109 @@
+import hashlib
+import os
+import time
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from sqlite_store import SQLiteStore, SharedInstance
+
+# Defaults for the embedding cache, can be overridden from the environment
+DEFAULT_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join('data', 'embedding_cache.sqlite'))
+DEFAULT_CACHE_MAX_BYTES = int(float(os.getenv('EMBEDDING_CACHE_MAX_MB', 200)) * 1024 * 1024)
+
+
+# Embeddings already computed, keyed by the sha256 of the embedding model id and the text
+class EmbeddingCache(SQLiteStore):
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at);
+        """)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(model_id, text):
+        return hashlib.sha256(f'{model_id}\n{text}'.encode('utf-8')).hexdigest()
+
+    # Method to look up many embeddings at once, returns a dict of key to embedding for the keys found
+    def lookup(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            # SQLite limits the number of parameters of a statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.connection.execute(
+                    f'SELECT key, embedding FROM embeddings WHERE key IN ({", ".join("?" for _ in batch)})', batch
+                ).fetchall()
+                for key, embedding in rows:
+                    found[key] = np.frombuffer(embedding, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self.connection.executemany('UPDATE embeddings SET accessed_at = ? WHERE key = ?', [(now, key) for key in found])
+                self.connection.commit()
+        return found
+
+    # Method to store embeddings and evict the least recently used ones over the size limit
+    def store(self, model_id, entries):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, model, embedding, accessed_at) VALUES (?, ?, ?, ?)',
+                [(key, model_id, np.asarray(embedding, dtype=np.float32).tobytes(), now) for key, embedding in entries.items()]
+            )
+            self._evict()
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM embeddings')
+            self.connection.commit()
+
+    def _evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(LENGTH(embedding)), 0) FROM embeddings').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute('SELECT key, LENGTH(embedding) FROM embeddings ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.connection.execute('DELETE FROM embeddings WHERE key = ?', (key,))
+            total -= size
+
+
+# Embedding function that only computes the embeddings of texts it has not seen with the same model
+# used by the collection for queries and by VectorDatabase for upserts
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    def __init__(self, embedding_function, cache, model_id=None):
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.model_id = model_id or getattr(embedding_function, 'MODEL_NAME', type(embedding_function).__name__)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self.cache.make_key(self.model_id, text) for text in input]
+        found = self.cache.lookup(keys)
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in found:
+                missing[key] = text
+        if missing:
+            # The texts not in the cache are still embedded together in one call
+            computed = dict(zip(missing, self.embedding_function(list(missing.values()))))
+            self.cache.store(self.model_id, computed)
+            found.update({key: np.asarray(embedding, dtype=np.float32).tolist() for key, embedding in computed.items()})
+        return [found[key] for key in keys]
+
+
+# Shared cache, opened on first use
+_cache = SharedInstance(EmbeddingCache)
+
+
+# Function to get the shared embedding cache, returns None when caching is disabled
+def get_embedding_cache():
+    if os.getenv('EMBEDDING_CACHE', 'true').lower() != 'true':
+        return None
+    return _cache.get()
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Entries read from the collection per call when the index is loaded
+LOAD_PAGE_SIZE = 5000
+# Seconds after which the index is read again, entries written by other processes like a backfill are only seen after a reload
+RELOAD_INTERVAL = float(os.getenv('VECTOR_DB_EXACT_RELOAD_SECONDS', 300))
+# Filters whose matching rows are kept, the least recently used are dropped first
+MAX_CACHED_FILTERS = 32
+
+
+# Function to check a metadata dict against a Chroma where filter
+# supports $and, $or and the $eq, $ne, $gt, $gte, $lt, $lte, $in and $nin operators
+def matches_where(metadata, where):
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not compare(value, operator, operand, key in metadata):
+                    return False
+        elif metadata.get(key) != condition or key not in metadata:
+            return False
+    return True
+
+
+def compare(value, operator, operand, present):
+    if operator == '$eq':
+        return present and value == operand
+    if operator == '$ne':
+        return not present or value != operand
+    if operator == '$in':
+        return present and value in operand
+    if operator == '$nin':
+        return not present or value not in operand
+    # Range operators only match numbers, like Chroma
+    if not present or isinstance(value, (str, bool)):
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise Exception(f'Unsupported where operator {operator}')
+
+
+# Function to check a document text against a Chroma where_document filter, $contains and $not_contains combined with $and and $or
+def matches_where_document(document, where_document):
+    document = document or ''
+    for key, condition in where_document.items():
+        if key == '$and':
+            if not all(matches_where_document(document, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where_document(document, clause) for clause in condition):
+                return False
+        elif key == '$contains':
+            if condition not in document:
+                return False
+        elif key == '$not_contains':
+            if condition in document:
+                return False
+        else:
+            raise Exception(f'Unsupported where_document operator {key}')
+    return True
+
+
+# Brute force nearest neighbour search over every embedding of a collection, an alternative to its HNSW index
+# the embeddings are kept normalized in one contiguous float32 matrix, a query is a single matrix product
+# distances follow the space of the collection (l2, cosine or ip) so they compare with the HNSW results
+class ExactSearchIndex:
+    def __init__(self, collection):
+        self.collection = collection
+        self.space = (collection.metadata or {}).get('hnsw:space', 'l2')
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = 0
+        self.size = 0
+        self.matrix = None
+        self.norms = None
+        self.ids = []
+        self.metadatas = []
+        self.documents = []
+        self.positions = {}
+        # Rows matching a filter, reused until the next write
+        self.masks = OrderedDict()
+
+    # Method to read every entry of the collection, entries written by other processes are only seen after a reload
+    def reload(self):
+        with self.lock:
+            self.size = 0
+            self.matrix = None
+            self.norms = None
+            self.ids, self.metadatas, self.documents = [], [], []
+            self.positions = {}
+            self.masks = OrderedDict()
+            offset = 0
+            while True:
+                page = self.collection.get(include=["embeddings", "metadatas", "documents"], limit=LOAD_PAGE_SIZE, offset=offset)
+                if not page['ids']:
+                    break
+                self._upsert(page['ids'], page['embeddings'], page['metadatas'], page['documents'])
+                offset += len(page['ids'])
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    # Method to check whether the index should be read again
+    # the writes of this process are applied as they happen, a different count means another process wrote to the collection
+    def is_stale(self):
+        if not self.loaded or time.monotonic() - self.loaded_at > RELOAD_INTERVAL:
+            return True
+        return self.collection.count() != self.size
+
+    # Method to apply entries written to the collection, ignored until the index is loaded since loading reads them
+    def upsert(self, ids, embeddings, metadatas, documents):
+        with self.lock:
+            if self.loaded:
+                self._upsert(ids, embeddings, metadatas, documents)
+
+    def delete(self, ids):
+        with self.lock:
+            if not self.loaded:
+                return
+            self.masks.clear()
+            for id in ids:
+                position = self.positions.pop(id, None)
+                if position is None:
+                    continue
+                # The last row takes the place of the deleted one so the matrix stays contiguous
+                last = self.size - 1
+                if position != last:
+                    self.matrix[position] = self.matrix[last]
+                    self.norms[position] = self.norms[last]
+                    self.ids[position] = self.ids[last]
+                    self.metadatas[position] = self.metadatas[last]
+                    self.documents[position] = self.documents[last]
+                    self.positions[self.ids[position]] = position
+                self.ids.pop()
+                self.metadatas.pop()
+                self.documents.pop()
+                self.size = last
+
+    # Method to find the n_results nearest entries of every query embedding
+    # returns the same lists of ids, metadatas, documents and distances per query as collection.query
+    def query(self, query_embeddings, n_results=2, where=None, where_document=None):
+        if self.is_stale():
+            self.reload()
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        with self.lock:
+            rows = self._filter(where, where_document)
+            if self.matrix is None:
+                matrix, norms = np.zeros((0, queries.shape[1]), dtype=np.float32), np.zeros(0, dtype=np.float32)
+            elif rows is None:
+                matrix, norms = self.matrix[:self.size], self.norms[:self.size]
+            else:
+                matrix, norms = self.matrix[rows], self.norms[rows]
+            count = min(n_results, len(matrix))
+            results = {"ids": [], "metadatas": [], "documents": [], "distances": []}
+            if count == 0:
+                for key in results:
+                    results[key] = [[] for _ in queries]
+                return results
+
+            query_norms = np.linalg.norm(queries, axis=1)
+            cosine = (queries / np.maximum(query_norms, 1e-12)[:, None]) @ matrix.T
+            if self.space == 'cosine':
+                distances = 1 - cosine
+            elif self.space == 'ip':
+                distances = 1 - cosine * query_norms[:, None] * norms[None, :]
+            else:
+                # Squared euclidean distance, like hnswlib
+                distances = query_norms[:, None] ** 2 + norms[None, :] ** 2 - 2 * cosine * query_norms[:, None] * norms[None, :]
+
+            # Only the n_results best of every query are sorted
+            if count < len(matrix):
+                nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+            else:
+                nearest = np.broadcast_to(np.arange(len(matrix)), (len(queries), len(matrix)))
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+            for query_rows, query_distances in zip(nearest, nearest_distances):
+                positions = query_rows if rows is None else rows[query_rows]
+                results['ids'].append([self.ids[position] for position in positions])
+                results['metadatas'].append([self.metadatas[position] for position in positions])
+                results['documents'].append([self.documents[position] for position in positions])
+                results['distances'].append(query_distances.tolist())
+            return results
+
+    def _upsert(self, ids, embeddings, metadatas, documents):
+        if not ids:
+            return
+        self.masks.clear()
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1)
+        vectors /= np.maximum(norms, 1e-12)[:, None]
+        metadatas = metadatas or [None] * len(ids)
+        documents = documents or [None] * len(ids)
+        for id, vector, norm, metadata, document in zip(ids, vectors, norms, metadatas, documents):
+            position = self.positions.get(id)
+            if position is None:
+                position = self.size
+                self._reserve(position + 1, len(vector))
+                self.positions[id] = position
+                self.ids.append(id)
+                self.metadatas.append(metadata)
+                self.documents.append(document)
+                self.size += 1
+            else:
+                self.metadatas[position] = metadata
+                self.documents[position] = document
+            self.matrix[position] = vector
+            self.norms[position] = norm
+
+    # Method to grow the matrix by doubling its capacity, so appending one entry at a time does not copy it every time
+    def _reserve(self, rows, dimension):
+        if self.matrix is not None and rows <= len(self.matrix):
+            return
+        capacity = max(rows, 1024, 2 * (len(self.matrix) if self.matrix is not None else 0))
+        matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float32)
+        if self.matrix is not None:
+            matrix[:self.size] = self.matrix[:self.size]
+            norms[:self.size] = self.norms[:self.size]
+        self.matrix, self.norms = matrix, norms
+
+    # Method to get the positions of the entries matching the filters, None when nothing is filtered
+    def _filter(self, where, where_document):
+        if not where and not where_document:
+            return None
+        key = (repr(where), repr(where_document))
+        if key in self.masks:
+            self.masks.move_to_end(key)
+            return self.masks[key]
+        rows = np.array([
+            position for position in range(self.size)
+            if (not where or matches_where(self.metadatas[position], where))
+            and (not where_document or matches_where_document(self.documents[position], where_document))
+        ], dtype=np.int64)
+        # Bounded, the filters of the similarity queries exclude the queried issue and differ for every issue
+        self.masks[key] = rows
+        if len(self.masks) > MAX_CACHED_FILTERS:
+            self.masks.popitem(last=False)
+        return rows
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urlencode
+from sqlite_store import SQLiteStore, SharedInstance
+
+# Defaults for the GitHub response cache, can be overridden from the environment
+DEFAULT_CACHE_PATH = os.getenv('GITHUB_CACHE_PATH', os.path.join('data', 'github_cache.sqlite'))
+DEFAULT_CACHE_TTL = float(os.getenv('GITHUB_CACHE_TTL', 60))
+DEFAULT_CACHE_MAX_BYTES = int(float(os.getenv('GITHUB_CACHE_MAX_MB', 50)) * 1024 * 1024)
+
+# Response headers kept with the cached body, Link is needed to keep paginating from the cache
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Link', 'Content-Type')
+
+
+class ResponseCache(SQLiteStore):
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+        """)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    # Method to build the cache key for a GET request, responses are cached per token, URL, params and Accept header
+    @staticmethod
+    def make_key(github_token, url, params=None, accept=None):
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        token_digest = hashlib.sha256((github_token or '').encode('utf-8')).hexdigest()
+        raw = '\n'.join([token_digest, url, query, accept or ''])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # Method to look up a cached response, returns a dict with headers, body and whether it is still fresh
+    def lookup(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT headers, body, fetched_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+        headers, body, fetched_at = row
+        return {
+            'headers': json.loads(headers),
+            'body': body,
+            'fresh': time.time() - fetched_at < self.ttl,
+        }
+
+    # Method to store a successful response and evict the least recently used entries over the size limit
+    def store(self, key, url, headers, body):
+        headers = {name: headers[name] for name in CACHED_HEADERS if name in headers}
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, url, headers, body, size, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, json.dumps(headers), body, len(body), now, now)
+            )
+            self._evict()
+            self.connection.commit()
+
+    # Method to mark a cached response as revalidated after a 304 Not Modified
+    def touch(self, key):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+            self.connection.commit()
+
+    # Method to drop every cached response whose URL starts with the given prefix
+    def invalidate(self, url_prefix):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses WHERE substr(url, 1, ?) = ?', (len(url_prefix), url_prefix))
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.connection.commit()
+
+    def _evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+
+
+# Shared cache instance, opened on first use
+_cache = SharedInstance(ResponseCache)
+
+
+# Function to get the shared response cache, returns None when caching is disabled
+def get_response_cache():
+    if os.getenv('GITHUB_CACHE', 'true').lower() != 'true':
+        return None
+    return _cache.get()
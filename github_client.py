@@ -0,0 +1,196 @@
+import os
+import threading
+from urllib.parse import urlparse
+import backoff
+import requests
+from requests.adapters import HTTPAdapter
+from github_cache import get_response_cache
+from rate_limiter import MAX_RETRIES, RateLimitedError, get_rate_limit_scheduler, resource_for_url
+
+GITHUB_API_HOST = 'api.github.com'
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Defaults for the shared connection pools, can be overridden from the environment
+DEFAULT_POOL_SIZE = int(os.getenv('GITHUB_POOL_SIZE', 10))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('GITHUB_CONNECT_TIMEOUT', 5))
+DEFAULT_READ_TIMEOUT = float(os.getenv('GITHUB_READ_TIMEOUT', 30))
+# Maximum number of GitHub requests sent at the same time by the batch helpers
+DEFAULT_CONCURRENCY = int(os.getenv('GITHUB_CONCURRENCY', 8))
+
+# One client per (token, host), shared by every IssueDocumenter instance
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class GitHubClient:
+    def __init__(self, github_token=None, host=GITHUB_API_HOST, pool_size=None, timeout=None):
+        self.github_token = github_token
+        self.host = host
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+        # Keep-alive session, the adapter keeps up to pool_size open connections to the host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Only the GitHub API is rate limited, attachment hosts are not scheduled
+        self.scheduler = get_rate_limit_scheduler(github_token) if host == GITHUB_API_HOST else None
+
+    # Method to send a request through the pooled session, applying the default timeout
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self._send(method, url, **kwargs)
+        except RateLimitedError as e:
+            # Out of retries, hand the rate limited response back to the caller
+            response = e.response
+        if method != 'GET' and response.ok:
+            self.invalidate_cache(url)
+        return response
+
+    # Method to send a request once the scheduler allows it, retrying rate limited responses with jittered exponential backoff
+    @backoff.on_exception(backoff.expo, RateLimitedError, max_tries=MAX_RETRIES, jitter=backoff.full_jitter)
+    def _send(self, method, url, **kwargs):
+        if self.scheduler is None:
+            return self.session.request(method, url, **kwargs)
+        resource = resource_for_url(url)
+        self.scheduler.acquire(resource)
+        response = self.session.request(method, url, **kwargs)
+        if self.scheduler.update(resource, response.status_code, response.headers, response.text if response.status_code in (403, 429) else ''):
+            raise RateLimitedError(response)
+        return response
+
+    # Method to GET a URL through the on-disk cache, revalidating stale entries with a conditional request
+    # with revalidate even fresh entries are checked with GitHub, e.g. when a webhook reported a change
+    def cached_get(self, url, params=None, headers=None, revalidate=False, **kwargs):
+        cache = get_response_cache()
+        if cache is None:
+            return self.get(url, params=params, headers=headers, **kwargs)
+
+        headers = dict(headers or {})
+        key = cache.make_key(self.github_token, url, params, headers.get('Accept'))
+        entry = cache.lookup(key)
+        if entry and entry['fresh'] and not revalidate:
+            return self._cached_response(url, entry)
+
+        if entry:
+            if 'ETag' in entry['headers']:
+                headers['If-None-Match'] = entry['headers']['ETag']
+            if 'Last-Modified' in entry['headers']:
+                headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+
+        response = self.get(url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and entry:
+            # Not modified, 304 responses do not count against the rate limit
+            cache.touch(key)
+            return self._cached_response(url, entry)
+        if response.status_code == 200:
+            cache.store(key, url, response.headers, response.content)
+        return response
+
+    # Method to iterate over every item of a paginated REST endpoint, following the Link header
+    def paginate(self, url, params=None, headers=None, items_key=None, per_page=100, on_page=None, revalidate=False):
+        params = dict(params or {})
+        params.setdefault('per_page', per_page)
+        while url:
+            response = self.cached_get(url, params=params, headers=headers, revalidate=revalidate)
+            response.raise_for_status()
+            page = response.json()
+            if on_page:
+                on_page(page)
+            items = page[items_key] if items_key else page
+            for item in items:
+                yield item
+            # The next URL already carries the query string
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+    # Method to run a GraphQL query and return its data, raising when GitHub reports errors
+    # with allow_partial the errors are only printed and the data that could be resolved is returned
+    def graphql(self, query, variables=None, headers=None, allow_partial=False):
+        request_headers = {
+            'Authorization': f'Bearer {self.github_token}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/vnd.github.vixen-preview+json'
+        }
+        request_headers.update(headers or {})
+        response = self.post(GITHUB_GRAPHQL_URL, headers=request_headers, json={'query': query, 'variables': variables or {}})
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errors'):
+            if not allow_partial or not result.get('data'):
+                raise Exception(f"GraphQL query failed: {result['errors']}")
+            print(f"GraphQL query returned errors: {[error.get('message') for error in result['errors']]}")
+        if self.scheduler and result['data'].get('rateLimit'):
+            self.scheduler.update_graphql_cost(result['data']['rateLimit'])
+        return result['data']
+
+    # Method to iterate over a GraphQL connection, following pageInfo.endCursor
+    # the query must accept a $cursor variable and select pageInfo { hasNextPage endCursor } on the connection
+    def paginate_graphql(self, query, variables, connection_path, cursor=None):
+        variables = dict(variables or {})
+        variables['cursor'] = cursor
+        while True:
+            connection = self.graphql(query, variables)
+            for key in connection_path:
+                connection = connection[key]
+            for item in connection['edges'] if 'edges' in connection else connection['nodes']:
+                yield item
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            variables['cursor'] = connection['pageInfo']['endCursor']
+
+    # Method to drop cached reads for the repository a write request touched
+    def invalidate_cache(self, url):
+        cache = get_response_cache()
+        if cache is None:
+            return
+        parsed = urlparse(url)
+        parts = parsed.path.strip('/').split('/')
+        if len(parts) >= 3 and parts[0] == 'repos':
+            cache.invalidate(f'{parsed.scheme}://{parsed.netloc}/repos/{parts[1]}/{parts[2]}')
+
+    def _cached_response(self, url, entry):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers.update(entry['headers'])
+        response._content = entry['body']
+        response.encoding = 'utf-8'
+        response.from_cache = True
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# Function to get the shared client for a token and host, creating it on first use
+def get_github_client(github_token=None, host=GITHUB_API_HOST, pool_size=None, timeout=None):
+    key = (github_token, host)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = GitHubClient(github_token, host, pool_size, timeout)
+            _clients[key] = client
+        return client
+
+
+# Function to close every shared client, e.g. when the application shuts down
+def close_github_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
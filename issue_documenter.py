@@ -1,107 +1,398 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+import hashlib
 import os
-import requests
-from bs4 import BeautifulSoup
+import importlib.util
+import re
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
-from vector_database import VectorDatabase
+from attachment_store import get_attachment_store
+from github_client import DEFAULT_CONCURRENCY, get_github_client
+from issue_files import comments_offset, issue_doc_id, issue_document_path, issue_report_text, legacy_issue_doc_id
+from issue_state import get_issue_state_store
+from lexical_index import get_lexical_index, reciprocal_rank_fusion
+from project_index import DEFAULT_SYNC_TTL as PROJECT_INDEX_TTL, get_project_index
+from vector_database import VectorDatabase, chunk_markdown, label_key, metadata_filter, timestamp
+
+# Links with these extensions are downloaded as attachments
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+# Comments are only parsed as HTML when they contain an image or a link tag
+TAG_PATTERN = re.compile(r'<(?:img|a)\b', re.IGNORECASE)
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+# Number of issues fetched in a single GraphQL request, the batches of a larger request are fetched concurrently, up to GITHUB_CONCURRENCY at a time
+ISSUE_BATCH_SIZE = int(os.getenv('GITHUB_ISSUE_BATCH_SIZE', 25))
+
+# Fields read for every issue comment fetched through GraphQL
+COMMENT_FRAGMENT = """
+fragment CommentFields on IssueComment {
+    databaseId
+    body
+    createdAt
+    updatedAt
+    author {
+        login
+    }
+}
+"""
+
+# Fields read for every issue fetched through GraphQL, the first 100 comments come with the issue
+ISSUE_FRAGMENT = """
+fragment IssueFields on Issue {
+    number
+    title
+    body
+    state
+    createdAt
+    updatedAt
+    author {
+        login
+    }
+    labels(first: 50) {
+        nodes {
+            name
+        }
+    }
+    comments(first: 100) {
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+        nodes {
+            ...CommentFields
+        }
+    }
+}
+""" + COMMENT_FRAGMENT
+
+# Number of status updates sent in a single GraphQL request
+STATUS_UPDATE_BATCH_SIZE = 50
+
+# Fields read for every project item, shared by the board listing and the index sync
+PROJECT_ITEM_FRAGMENT = """
+fragment ProjectItemFields on ProjectV2Item {
+    id,
+    createdAt,
+    updatedAt,
+    type,
+    fieldValues(first: 20) {
+        nodes {
+            ... on ProjectV2ItemFieldSingleSelectValue {
+                field {
+                    ... on ProjectV2SingleSelectField {
+                        name
+                    }
+                }
+                name
+                id
+            }
+        }
+    },
+    content {
+        ... on Issue {
+            number,
+            title,
+            url,
+            state,
+            updatedAt,
+            labels(first:10) {
+                nodes {
+                    name,
+                    color
+                }
+            }
+        }
+    }
+}
+"""
 
-# Initialize the database
+# The database is opened on first use, see get_database
 database = None
-if not database:
-    database = VectorDatabase()
+_database_lock = threading.Lock()
+
+# Function to get the shared vector database, opening it on first use
+def get_database():
+    global database
+    with _database_lock:
+        if database is None:
+            database = VectorDatabase()
+        return database
 
 class IssueDocumenter:
-    def __init__(self, github_token, repo_owner, repo_name, issue_number=None):
+    # revalidate checks every cached read of the issue and its comments with GitHub, for callers that know the issue just changed
+    def __init__(self, github_token, repo_owner, repo_name, issue_number=None, revalidate=False):
         self.github_token = github_token
         self.repo_owner = repo_owner
         self.repo_name = repo_name
         self.issue_number = issue_number
+        self.revalidate = revalidate
         self.base_url = f'https://api.github.com/repos/{self.repo_owner}/{self.repo_name}'
         self.output_dir = 'downloads'
         self.headers = {'Authorization': f'token {self.github_token}'}
+        # Shared keep-alive client, reused by every documenter with the same token
+        self.client = get_github_client(self.github_token)
         os.makedirs(self.output_dir, exist_ok=True)
 
+    # The local stores are shared by every documenter and opened on first use, helpers like the release functions need none of them
+    @property
+    def attachments(self):
+        return get_attachment_store()
+
+    @property
+    def issue_states(self):
+        return get_issue_state_store()
+
+    @property
+    def project_index(self):
+        return get_project_index()
+
+    @property
+    def lexical_index(self):
+        return get_lexical_index()
+
+    @property
+    def duplicate_index(self):
+        # numpy and mmh3 are only imported once duplicates are indexed or looked for
+        from duplicate_detector import get_duplicate_index
+        return get_duplicate_index()
+
     # Method to get issue details and comments from GitHub
     def get_issue(self):
-        issue_url = f'{self.base_url}/issues/{self.issue_number}'
-        headers = {'Authorization': f'token {self.github_token}'}
-        issue_response = requests.get(issue_url, headers=headers)
-        if issue_response.status_code == 404:
-            print(f"Issue {self.issue_number} not found")
+        issue_data = self.fetch_issue()
+        if not issue_data:
             return None, None
-        issue_response.raise_for_status()
-        issue_data = issue_response.json()
 
-        comments_url = f'{self.base_url}/issues/{self.issue_number}/comments'
-        comments_response = requests.get(comments_url, headers=headers)
-        comments_response.raise_for_status()
-        comments_data = comments_response.json()
+        comments_data = list(self.iter_issue_comments())
 
         return issue_data, comments_data
+
+    # Method to get the issue details without the comments, returns None when the issue does not exist
+    def fetch_issue(self):
+        issue_response = self.client.cached_get(f'{self.base_url}/issues/{self.issue_number}', headers=self.headers, revalidate=self.revalidate)
+        if issue_response.status_code == 404:
+            print(f"Issue {self.issue_number} not found")
+            return None
+        issue_response.raise_for_status()
+        return issue_response.json()
+
+    # Method to iterate over every comment of an issue, page by page
+    # pass since (an ISO 8601 timestamp) to only get comments created or updated after it
+    def iter_issue_comments(self, issue_number=None, since=None):
+        comments_url = f'{self.base_url}/issues/{issue_number or self.issue_number}/comments'
+        params = {'since': since} if since else None
+        return self.client.paginate(comments_url, params=params, headers=self.headers, revalidate=self.revalidate)
     
-    # Method to update the status of an issue in a GitHub project
-    def update_issue_status(self, issue_number, status, project_number, org_name=None, user_name=None):
-        graphql_url = 'https://api.github.com/graphql'
-        headers = {
-            'Authorization': f'Bearer {self.github_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/vnd.github.vixen-preview+json'
-        }
+    # Method to get many issues with their comments through aliased GraphQL queries, ISSUE_BATCH_SIZE issues per query
+    # the queries are sent concurrently, at most concurrency at a time (GITHUB_CONCURRENCY by default)
+    # returns a dict of issue number to (issue, comments) shaped like the REST responses, missing issues are left out
+    def get_issues_graphql(self, issue_numbers, concurrency=None):
+        issue_numbers = list(dict.fromkeys(issue_numbers))
+        batches = [issue_numbers[i:i + ISSUE_BATCH_SIZE] for i in range(0, len(issue_numbers), ISSUE_BATCH_SIZE)]
+        if len(batches) <= 1:
+            batch_results = [self.get_issue_batch_graphql(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency or DEFAULT_CONCURRENCY, len(batches))) as executor:
+                batch_results = list(executor.map(self.get_issue_batch_graphql, batches))
+        results = {}
+        for batch_result in batch_results:
+            results.update(batch_result)
+        # Keep the order of the requested issue numbers
+        return {number: results[number] for number in issue_numbers if number in results}
+
+    # Method to get one batch of issues with their comments in a single aliased GraphQL query
+    def get_issue_batch_graphql(self, batch):
+        aliases = '\n'.join(f'issue_{number}: issue(number: {int(number)}) {{ ...IssueFields }}' for number in batch)
+        query = f"""
+        query($owner: String!, $name: String!) {{
+            repository(owner: $owner, name: $name) {{
+                {aliases}
+            }}
+        }}
+        """ + ISSUE_FRAGMENT
+        data = self.client.graphql(query, {'owner': self.repo_owner, 'name': self.repo_name}, allow_partial=True)
+        results = {}
+        for number in batch:
+            node = data['repository'].get(f'issue_{number}')
+            if not node:
+                print(f"Issue {number} not found")
+                continue
+            results[number] = self.issue_from_graphql(node)
+        return results
 
-        mutation_query = """
-        mutation($projectId: ID!, $itemId: ID!, $status: String!) {
-            updateProjectV2ItemFieldValue(
-                input: {
-                    projectId: $projectId,
-                    itemId: $itemId,
-                    fieldId: "status",
-                    value: "Done"
-                }
-            ) {
-                projectV2Item {
-                    id
+    # Method to convert an issue node with its first page of comments into (issue, comments), fetching the remaining comments
+    def issue_from_graphql(self, node):
+        comments = node['comments']['nodes']
+        if node['comments']['pageInfo']['hasNextPage']:
+            # Long threads continue from the cursor of the batched query
+            comments = comments + list(self.iter_issue_comments_graphql(node['number'], node['comments']['pageInfo']['endCursor']))
+        return graphql_issue_to_rest(node), [graphql_comment_to_rest(comment) for comment in comments]
+
+    # Method to iterate over every issue of the repository, oldest first, one page at a time
+    # yields the page as a dict of issue number to (issue, comments) with the cursor to resume after it
+    def iter_repository_issue_pages(self, cursor=None, page_size=ISSUE_BATCH_SIZE):
+        query = """
+        query($owner: String!, $name: String!, $pageSize: Int!, $cursor: String) {
+            rateLimit {
+                cost
+                remaining
+                resetAt
+            }
+            repository(owner: $owner, name: $name) {
+                issues(first: $pageSize, after: $cursor, orderBy: {field: CREATED_AT, direction: ASC}) {
+                    totalCount
+                    pageInfo {
+                        hasNextPage
+                        endCursor
+                    }
+                    nodes {
+                        ...IssueFields
+                    }
                 }
             }
         }
-        """
+        """ + ISSUE_FRAGMENT
+        variables = {'owner': self.repo_owner, 'name': self.repo_name, 'pageSize': page_size, 'cursor': cursor}
+        while True:
+            connection = self.client.graphql(query, variables)['repository']['issues']
+            page = {node['number']: self.issue_from_graphql(node) for node in connection['nodes']}
+            yield page, connection['pageInfo']['endCursor'] or variables['cursor'], connection['totalCount']
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            variables['cursor'] = connection['pageInfo']['endCursor']
 
-        project_query = """
-        query($owner: String!, $projectNumber: Int!) {
-            {entity}(login: $owner) {
-                projectV2(number: $projectNumber) {
-                    id
+    # Method to iterate over the comments of an issue through GraphQL, starting after the given cursor
+    def iter_issue_comments_graphql(self, issue_number, cursor=None):
+        query = """
+        query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+            repository(owner: $owner, name: $name) {
+                issue(number: $number) {
+                    comments(first: 100, after: $cursor) {
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                        nodes {
+                            ...CommentFields
+                        }
+                    }
                 }
             }
         }
-        """.replace("{entity}", "organization" if org_name else "user")
-
-        project_variables = {
-            'owner': org_name if org_name else user_name,
-            'projectNumber': project_number
-        }
-
-        response = requests.post(
-            graphql_url,
-            headers=headers,
-            json={'query': project_query, 'variables': project_variables}
-        )
-        response.raise_for_status()
-        project_data = response.json()
-        project_id = project_data['data']['organization' if org_name else 'user']['projectV2']['id']
+        """ + COMMENT_FRAGMENT
+        variables = {'owner': self.repo_owner, 'name': self.repo_name, 'number': int(issue_number)}
+        return self.client.paginate_graphql(query, variables, ['repository', 'issue', 'comments'], cursor)
+
+    # Method to document many issues with a few concurrent GraphQL requests, adding the changed documents to the vector database in one batch
+    def document_issues(self, issue_numbers, concurrency=None):
+        return self.document_fetched_issues(self.get_issues_graphql(issue_numbers, concurrency), issue_numbers)
+
+    # Method to build and save the documents of already fetched issues, adding the changed ones to the vector database in one batch
+    # with reindex the unchanged documents are indexed too
+    def document_fetched_issues(self, fetched, issue_numbers=None, reindex=False):
+        results = {}
+        documents = []
+        issue_numbers = list(fetched) if issue_numbers is None else issue_numbers
+        with self.issue_states.batch():
+            for issue_number in issue_numbers:
+                if issue_number not in fetched:
+                    results[issue_number] = f"Issue {issue_number} not found"
+                    continue
+                issue, comments = fetched[issue_number]
+                content = self.write_issue_document(issue_number, self.iter_issue_document(issue, comments))
+                # Without the previous state the content counts as changed
+                state = None if reindex else self.issue_states.get(self.repo_owner, self.repo_name, issue_number)
+                if self.record_issue_document(issue, comments, content, state):
+                    documents.append(issue_vector_document(issue, content, self.repo_owner, self.repo_name))
+                results[issue_number] = content
+
+        if documents:
+            self.index_issue_documents(documents)
+        print(f"Documented {len(fetched)} of {len(issue_numbers)} issues")
+        return results
 
-        item_query = """
+    # Method to update the status of an issue in a GitHub project
+    def update_issue_status(self, issue_number, status, project_number, org_name=None, user_name=None):
+        self.update_issues_status([issue_number], status, project_number, org_name, user_name)
+
+    # Method to update the status of many issues in a GitHub project
+    # ids come from the project index and the mutations are sent in batches of aliased updates
+    def update_issues_status(self, issue_numbers, status, project_number, org_name=None, user_name=None):
+        project_id = self.resolve_project(project_number, org_name, user_name)
+        field_id, option_id, status = self.resolve_status_option(project_id, status)
+
+        item_ids = self.project_index.find_items(project_id, issue_numbers)
+        if len(item_ids) < len(set(issue_numbers)):
+            # Some issues are not in the index yet, bring it up to date and look again
+            self.sync_project_index(project_number, org_name, user_name, force=True)
+            item_ids = self.project_index.find_items(project_id, issue_numbers)
+        missing = [issue_number for issue_number in issue_numbers if issue_number not in item_ids]
+        if missing:
+            print(f"Issues {missing} are not in project {project_number}")
+
+        numbers = [issue_number for issue_number in issue_numbers if issue_number in item_ids]
+        for i in range(0, len(numbers), STATUS_UPDATE_BATCH_SIZE):
+            batch = numbers[i:i + STATUS_UPDATE_BATCH_SIZE]
+            declarations = ''.join(f', $item{j}: ID!' for j in range(len(batch)))
+            updates = '\n'.join(f"""
+                update{j}: updateProjectV2ItemFieldValue(
+                    input: {{
+                        projectId: $projectId,
+                        itemId: $item{j},
+                        fieldId: $fieldId,
+                        value: {{ singleSelectOptionId: $optionId }}
+                    }}
+                ) {{
+                    projectV2Item {{
+                        id
+                    }}
+                }}""" for j in range(len(batch)))
+            mutation_query = f"""
+            mutation($projectId: ID!, $fieldId: ID!, $optionId: String!{declarations}) {{
+                {updates}
+            }}
+            """
+            update_variables = {
+                'projectId': project_id,
+                'fieldId': field_id,
+                'optionId': option_id
+            }
+            for j, issue_number in enumerate(batch):
+                update_variables[f'item{j}'] = item_ids[issue_number]
+            self.client.graphql(mutation_query, update_variables)
+            self.project_index.set_board_status([item_ids[issue_number] for issue_number in batch], status)
+            print(f"Issues {batch} status updated to {status} in project {project_number}")
+
+    # Method to get the Status field id, the option id and the option name for a status name, cached in the project index
+    # the field is fetched again when the status is not among the cached options, e.g. an option added or renamed on the board
+    def resolve_status_option(self, project_id, status):
+        field = self.project_index.get_field(project_id, 'Status')
+        cached = field is not None
+        if not cached:
+            field = self.fetch_status_field(project_id)
+
+        option = next((option for option in field['options'] if option['name'].lower() == status.lower()), None)
+        if not option and cached:
+            field = self.fetch_status_field(project_id)
+            option = next((option for option in field['options'] if option['name'].lower() == status.lower()), None)
+        if not option:
+            raise Exception(f"Status {status} not found, available statuses: {[option['name'] for option in field['options']]}")
+        return field['id'], option['id'], option['name']
+
+    # Method to fetch the Status field of a project with its options and store it in the project index
+    def fetch_status_field(self, project_id):
+        field_query = """
         query($projectId: ID!) {
             node(id: $projectId) {
                 ... on ProjectV2 {
-                    items(first: 100) {
-                        edges {
-                            node {
+                    field(name: "Status") {
+                        ... on ProjectV2SingleSelectField {
+                            id
+                            options {
                                 id
-                                content {
-                                    ... on Issue {
-                                        number
-                                    }
-                                }
+                                name
                             }
                         }
                     }
@@ -109,72 +400,228 @@ class IssueDocumenter:
             }
         }
         """
+        data = self.client.graphql(field_query, {'projectId': project_id})
+        field = data['node']['field']
+        self.project_index.set_field(project_id, 'Status', field['id'], field['options'])
+        return field
 
-        item_variables = {
-            'projectId': project_id,
-            #'issueNumber': issue_number
-        }
-
-        response = requests.post(
-            graphql_url,
-            headers=headers,
-            json={'query': item_query, 'variables': item_variables}
+    # Method to get similar issues from the vector database
+    # by default only the issues of the same repository are searched, state, labels and creation dates narrow it further
+    # the stored embeddings of the issue are the queries, the issue is only documented when it is not in the database yet
+    def get_similar_issues(self, state=None, labels=None, created_after=None, created_before=None, all_repos=False):
+        database = get_database()
+        repo = f'{self.repo_owner}/{self.repo_name}'
+        doc_id = issue_doc_id(self.repo_owner, self.repo_name, self.issue_number)
+        # In chunk order, the queries are the description and the first comments
+        query_embeddings = database.get_grouped_embeddings(metadata_filter(repo=repo, source='github', parent_id=doc_id)).get(doc_id)
+        query_texts = None
+        if not query_embeddings:
+            print(f"Issue {self.issue_number} is not in the vector database yet, documenting it")
+            query_embeddings = None
+            query_texts = chunk_markdown(self.document_issue())
+        where = metadata_filter(
+            repo=None if all_repos else repo, state=state, labels=labels,
+            created_after=created_after, created_before=created_before, source='github',
+            exclude={'parent_id': doc_id}
         )
-        response.raise_for_status()
-        item_data = response.json()
-        item_id = next(edge['node']['id'] for edge in item_data['data']['node']['items']['edges'] if edge['node']['content']['number'] == issue_number)
-
-        update_variables = {
-            'projectId': project_id,
-            'itemId': item_id,
-            'status': status
-        }
-
-        response = requests.post(
-            graphql_url,
-            headers=headers,
-            json={'query': mutation_query, 'variables': update_variables}
+        # The first chunks of the issue are the queries, the hits are grouped by issue
+        results = database.query_grouped(
+            query_texts, n_results=5, aggregate=os.getenv('SIMILARITY_AGGREGATE', 'max'), where=where, query_embeddings=query_embeddings
         )
-        #response.raise_for_status()
-        print(f"Issue {issue_number} status updated to {status} in project {project_number}")
-
-    # Method to get similar issues from the vector database
-    def get_similar_issues(self):
-        content = self.document_issue()
-        global database
-        results = database.query_documents(content, n_results=5)
         print(f"Found {len(results)} results")
-        results = [result for result in results if result['id'] != f'issue_{self.issue_number}']
-        distance_threshold = os.getenv('DISTANCE_THRESHOLD', 0.5)
+        distance_threshold = float(os.getenv('DISTANCE_THRESHOLD', 0.5))
         results = [result for result in results if result['distance'] < distance_threshold]
         print(f"Found {len(results)} similar issues ")
         return results
 
-    # Method to download a file from a URL
+    # Method to get the similar issues of many issues with a single vector query, returns a dict of issue number to similar issues
+    # the issues that are not in the vector database yet are documented together first
+    def get_similar_issues_batch(self, issue_numbers, state=None, labels=None, created_after=None, created_before=None, all_repos=False):
+        database = get_database()
+        issue_numbers = [int(issue_number) for issue_number in dict.fromkeys(issue_numbers)]
+        repo = f'{self.repo_owner}/{self.repo_name}'
+        parent_ids = {issue_number: issue_doc_id(self.repo_owner, self.repo_name, issue_number) for issue_number in issue_numbers}
+        embeddings = database.get_grouped_embeddings(metadata_filter(repo=repo, source='github', parent_ids=parent_ids.values()))
+        missing = [issue_number for issue_number in issue_numbers if parent_ids[issue_number] not in embeddings]
+        if missing:
+            print(f"{len(missing)} issues are not in the vector database yet, documenting them")
+            self.document_issues(missing)
+            embeddings.update(database.get_grouped_embeddings(metadata_filter(repo=repo, source='github', parent_ids=[parent_ids[issue_number] for issue_number in missing])))
+
+        # Issues that could not be documented, e.g. missing on GitHub, have no similar issues
+        found = [issue_number for issue_number in issue_numbers if parent_ids[issue_number] in embeddings]
+        where = metadata_filter(
+            repo=None if all_repos else repo, state=state, labels=labels,
+            created_after=created_after, created_before=created_before, source='github'
+        )
+        grouped_results = database.query_grouped_batch(
+            n_results=5, aggregate=os.getenv('SIMILARITY_AGGREGATE', 'max'), where=where,
+            query_embedding_groups=[embeddings[parent_ids[issue_number]] for issue_number in found],
+            exclude_ids=[parent_ids[issue_number] for issue_number in found]
+        )
+        distance_threshold = float(os.getenv('DISTANCE_THRESHOLD', 0.5))
+        results = {issue_number: [] for issue_number in issue_numbers}
+        for issue_number, issue_results in zip(found, grouped_results):
+            results[issue_number] = [result for result in issue_results if result['distance'] < distance_threshold]
+        print(f"Found similar issues for {sum(1 for issue_results in results.values() if issue_results)} of {len(issue_numbers)} issues")
+        return results
+
+    # Method to search the issue documents for a free text query, e.g. an error message or a stack frame
+    # mode is 'lexical' for BM25 keyword search, 'vector' for similarity search or 'hybrid' to fuse both rankings
+    def search_issue_documents(self, query, mode='hybrid', n_results=5, all_repos=False):
+        repo = None if all_repos else f'{self.repo_owner}/{self.repo_name}'
+        # Each ranking goes deeper than the results so the fusion can promote documents found by both
+        candidates = n_results * 2
+        lexical_hits = self.lexical_index.search(query, candidates, repo) if mode in ('lexical', 'hybrid') else []
+        vector_hits = []
+        if mode in ('vector', 'hybrid'):
+            vector_hits = get_database().query_grouped([query], candidates, where=metadata_filter(repo=repo, source='github'))
+
+        hits = {}
+        for hit in vector_hits:
+            hits[hit['id']] = {"id": hit['id'], "issue_number": hit['metadata'].get('issue_number'), "document": hit['document'], "distance": hit['distance']}
+        for hit in lexical_hits:
+            result = hits.setdefault(hit['id'], {"id": hit['id'], "issue_number": hit['issue_number']})
+            result.update(snippet=hit['snippet'], bm25=hit['score'])
+        fused = reciprocal_rank_fusion([[hit['id'] for hit in lexical_hits], [hit['id'] for hit in vector_hits]])
+        results = [dict(hits[doc_id], score=score) for doc_id, score in fused[:n_results]]
+        print(f"Found {len(results)} issues for '{query}' with {mode} search")
+        return results
+
+    # Method to add changed issue documents to the vector database, the full-text index and the duplicate index
+    def index_issue_documents(self, documents):
+        database = get_database()
+        database.upsert_chunked_documents(documents)
+        self.lexical_index.upsert_documents(documents)
+        self.duplicate_index.upsert_documents([dict(document, text=issue_report_text(document['document'])) for document in documents])
+        # Entries stored before the repository was part of the id could belong to any repository, they are replaced by the new ones
+        legacy_ids = [legacy_issue_doc_id(document['metadata']['issue_number']) for document in documents]
+        database.delete_chunked_documents(legacy_ids)
+        self.lexical_index.delete_documents(legacy_ids)
+        self.duplicate_index.delete_documents(legacy_ids)
+
+    # Method to find the issues that are likely duplicates of an issue, from the MinHash signatures of their title and description
+    # a cheap first pass before the vector search, the issue is only documented when it is not indexed yet
+    def get_likely_duplicates(self, threshold=None, all_repos=False):
+        from duplicate_detector import DEFAULT_THRESHOLD, minhash_signature
+        threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+        repo = f'{self.repo_owner}/{self.repo_name}'
+        doc_id = issue_doc_id(self.repo_owner, self.repo_name, self.issue_number)
+        signature = self.duplicate_index.get_signature(doc_id, repo)
+        if signature is None:
+            print(f"Issue {self.issue_number} is not in the duplicate index yet, documenting and adding it")
+            text = issue_report_text(self.document_issue())
+            # An unchanged document is not indexed again by document_issue
+            self.duplicate_index.upsert_documents([{"id": doc_id, "text": text, "metadata": {"repo": repo, "issue_number": self.issue_number}}])
+            signature = minhash_signature(text)
+        results = self.duplicate_index.find_duplicates(signature, None if all_repos else repo, threshold, exclude_id=doc_id)
+        print(f"Found {len(results)} likely duplicates of issue {self.issue_number}")
+        return results
+
+    # Method to remove a deleted or transferred issue from the issue documents, the issue state and the search indexes
+    def remove_issue_document(self):
+        output_file_name = issue_document_path(self.repo_owner, self.repo_name, self.issue_number)
+        if os.path.exists(output_file_name):
+            os.remove(output_file_name)
+        self.issue_states.delete(self.repo_owner, self.repo_name, self.issue_number)
+        doc_id = issue_doc_id(self.repo_owner, self.repo_name, self.issue_number)
+        get_database().delete_chunked_documents([doc_id])
+        self.lexical_index.delete_documents([doc_id])
+        self.duplicate_index.delete_documents([doc_id])
+
+    # Method to apply the title, state and labels of an issue to the items showing it in the project index
+    def update_project_items_for_issue(self, issue):
+        label_names = [label['name'] for label in issue['labels']]
+        return self.project_index.update_issue(
+            issue['html_url'], issue['title'], issue['state'].upper(),
+            [{'name': label['name'], 'color': label.get('color')} for label in issue['labels']],
+            product_from_labels(label_names), issue['updated_at']
+        )
+
+    # Method to download a file from a URL into the content-addressed attachment store
     def download_file(self, url):
-        local_filename = os.path.join(self.output_dir, url.split('/')[-1])
-        with requests.get(url, stream=True) as r:
-            try:
-                r.raise_for_status()
-            except:
-                return
-            with open(local_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        return local_filename
+        return self.attachments.download(url)
 
     # Method to document an issue and its comments
-    def document_issue(self):
-        issue, comments = self.get_issue()
-        if not issue:
-            return f"Issue {self.issue_number} not found"
-
+    # in incremental mode only the comments added since the last run are fetched and appended
+    def document_issue(self, incremental=True):
+        state = self.issue_states.get(self.repo_owner, self.repo_name, self.issue_number) if incremental else None
+        existing_content = self.read_issue_document(self.issue_number) if state else None
+        if existing_content is None:
+            issue, comments = self.get_issue()
+            if not issue:
+                return f"Issue {self.issue_number} not found"
+            content = self.write_issue_document(self.issue_number, self.iter_issue_document(issue, comments))
+        else:
+            issue = self.fetch_issue()
+            if not issue:
+                return f"Issue {self.issue_number} not found"
+            if issue['updated_at'] == state['updated_at']:
+                print(f"Issue {self.issue_number} has not changed since it was last documented")
+                return existing_content
+            comments, content = self.update_issue_document(issue, state, existing_content)
+            self.save_issue_document(self.issue_number, content)
+
+        if self.record_issue_document(issue, comments, content, state):
+            self.index_issue_documents([issue_vector_document(issue, content, self.repo_owner, self.repo_name)])
+
+        return content
+
+    # Method to refresh the document of an already documented issue with the comments posted since then
+    # returns every comment seen so far and the new content, falling back to a full rebuild when a known comment was edited
+    def update_issue_document(self, issue, state, existing_content):
+        known_comments = state['comments']
+        new_comments = []
+        for comment in self.iter_issue_comments(since=state['last_comment_at']):
+            known_updated_at = known_comments.get(str(comment['id']))
+            if known_updated_at is None:
+                new_comments.append(comment)
+            elif known_updated_at != comment['updated_at']:
+                print(f"A comment of issue {self.issue_number} was edited, documenting it again")
+                comments = list(self.iter_issue_comments())
+                return comments, self.build_issue_document(issue, comments)
+
+        # The header may have changed (title, status, labels), the comments section is kept and extended
+        comments_start = comments_offset(existing_content, state.get('header_length'))
+        if comments_start == -1:
+            comments = list(self.iter_issue_comments())
+            return comments, self.build_issue_document(issue, comments)
+        content = self.build_issue_header(issue) + existing_content[comments_start:] + ''.join(self.iter_comments_section(new_comments))
+        print(f"Added {len(new_comments)} new comments to issue {self.issue_number}")
+        comments = [{'id': comment_id, 'updated_at': updated_at} for comment_id, updated_at in known_comments.items()]
+        return comments + new_comments, content
+
+    # Method to remember the state of a saved document, returns True when the content changed
+    def record_issue_document(self, issue, comments, content, state=None):
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        self.issue_states.set(self.repo_owner, self.repo_name, issue['number'], {
+            'updated_at': issue['updated_at'],
+            'last_comment_at': max((comment['updated_at'] for comment in comments), default=issue['created_at']),
+            'comments': {str(comment['id']): comment['updated_at'] for comment in comments},
+            'content_hash': content_hash,
+            # Where the comments start in the saved document, the header only depends on the issue
+            'header_length': len(self.build_issue_header(issue))
+        })
+        if state and state.get('content_hash') == content_hash:
+            print(f"Issue {issue['number']} content is unchanged, skipping the vector database update")
+            return False
+        return True
+
+    # Method to build the markdown document for an issue and its comments
+    def build_issue_document(self, issue, comments):
+        return ''.join(self.iter_issue_document(issue, comments))
+
+    # Method to produce the markdown document of an issue piece by piece, the header first and then one piece per comment
+    def iter_issue_document(self, issue, comments):
+        yield self.build_issue_header(issue)
+        yield from self.iter_comments_section(comments)
+
+    # Method to build the issue details part of the document, up to the comments heading
+    def build_issue_header(self, issue):
         document_content = []
-        output_dir = 'downloads'
-        os.makedirs(output_dir, exist_ok=True)
 
         # Add the main issue details to the document content
-        document_content.append(f"# Issue #{self.issue_number}: {issue['title']}\n")
+        document_content.append(f"# Issue #{issue['number']}: {issue['title']}\n")
         document_content.append(f"**Author:** {issue['user']['login']}\n")
         document_content.append(f"**Date:** {issue['created_at']}\n")
         document_content.append(f"**Status:** {issue['state']}\n")
@@ -186,29 +633,38 @@ class IssueDocumenter:
         document_content.append(f"-------------------------------------\n")
         document_content.append(f"## Comments\n")
 
-        # Now process the comments
+        return '\n'.join(document_content)
+
+    # Method to produce the comments part of the document, one piece per comment, each starting with a line break
+    def iter_comments_section(self, comments):
+        # Find the images and links of every comment and download all the attachments concurrently before writing
+        parsed_comments = []
+        attachment_urls = []
         for comment in comments:
-            soup = BeautifulSoup(comment['body'], 'html.parser')
-            
+            img_urls, link_urls = extract_comment_links(comment['body'])
+            parsed_comments.append((comment, img_urls, link_urls))
+            attachment_urls.extend(img_urls)
+            attachment_urls.extend(url for url in link_urls if url.endswith(IMAGE_EXTENSIONS))
+        downloaded = self.attachments.download_all(attachment_urls)
+
+        # Now process the comments
+        for comment, img_urls, link_urls in parsed_comments:
+            document_content = []
             document_content.append(f"### Comment by {comment['user']['login']}\n")
             document_content.append(f"**Date:** {comment['created_at']}\n\n")
             #document_content.append(f"{comment['body']}\n")
 
-            comment_lines = comment['body'].split('\n')
-            blockquoted_comment = '\n'.join(f'> {line}' for line in comment_lines if line.strip() != '')
+            blockquoted_comment = '\n'.join(f'> {line}' for line in comment['body'].split('\n') if line.strip() != '')
             document_content.append(blockquoted_comment + '\n')
 
             # Process images and links within the comment
-            for img in soup.find_all('img'):
-                img_url = img['src']
-                #downloaded_image = self.download_file(img_url, output_dir)
-                downloaded_image = self.download_file(img_url)
+            for img_url in img_urls:
+                downloaded_image = downloaded[img_url]
                 document_content.append(f"![Downloaded image]({downloaded_image})\n")
 
-            for link in soup.find_all('a'):
-                link_url = link['href']
-                if link_url.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                    downloaded_link = self.download_file(link_url, output_dir)
+            for link_url in link_urls:
+                if link_url.endswith(IMAGE_EXTENSIONS):
+                    downloaded_link = downloaded[link_url]
                     document_content.append(f"![Downloaded file]({downloaded_link})\n")
                 else:
                     document_content.append(f"[Link]({link_url})\n")
@@ -216,21 +672,43 @@ class IssueDocumenter:
             # Add a separator between comments
             document_content.append(f"\n-------------------------\n")
 
-        output_file_name = f'issues/issue_{self.issue_number}_documentation.md'
-        with open(output_file_name, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(document_content))
-
-        global database
-        database.add_documents([
-            {"document": '\n'.join(document_content), "metadata": {"source": "github", "issue_number": self.issue_number}, "id": f"issue_{self.issue_number}"}
-        ])
+            yield '\n' + '\n'.join(document_content)
 
-        return '\n'.join(document_content)
+    # Method to read the saved document of an issue, returns None when it does not exist
+    def read_issue_document(self, issue_number):
+        output_file_name = issue_document_path(self.repo_owner, self.repo_name, issue_number)
+        if not os.path.exists(output_file_name):
+            return None
+        with open(output_file_name, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    # Method to save the markdown document of an issue in the issues folder
+    def save_issue_document(self, issue_number, content):
+        self.write_issue_document(issue_number, [content])
+        return issue_document_path(self.repo_owner, self.repo_name, issue_number)
+
+    # Method to write the pieces of a document to its file as they are produced, returns the whole text
+    # the file is written next to the old one and swapped in at the end, so readers never see half a document
+    # every write has its own temporary file, the webhook worker and the agent may write the same issue at once
+    def write_issue_document(self, issue_number, pieces):
+        output_file_name = issue_document_path(self.repo_owner, self.repo_name, issue_number)
+        output_directory = os.path.dirname(output_file_name)
+        os.makedirs(output_directory, exist_ok=True)
+        temp_fd, temp_file_name = tempfile.mkstemp(dir=output_directory, prefix=f'issue_{issue_number}_', suffix='.tmp')
+        document_content = []
+        try:
+            with os.fdopen(temp_fd, 'w', encoding='utf-8') as f:
+                for piece in pieces:
+                    f.write(piece)
+                    document_content.append(piece)
+            os.replace(temp_file_name, output_file_name)
+        except BaseException:
+            os.remove(temp_file_name)
+            raise
+        return ''.join(document_content)
 
     # Method to search for issues on GitHub
     def search_issues(self, status='open', labels=None, assignee=None, title_contains=None):
-        search_url = 'https://api.github.com/search/issues'
-        headers = {'Authorization': f'token {self.github_token}'}
         query = f'repo:{self.repo_owner}/{self.repo_name} state:{status}'
         
         if labels:
@@ -241,36 +719,40 @@ class IssueDocumenter:
             query += f' {title_contains} in:title'
         
         print(query)
-        params = {'q': query}
-        response = requests.get(search_url, headers=headers, params=params)
-        response.raise_for_status()
-        #print(response.text)
-        issues = response.json()['items']
-        
         # Exclude specific fields
         fields_to_exclude = {'body', 'user', 'reactions'}
         fields_to_include = {'closed_at', 'created_at', 'updated_at', 'title', 'number','state','labels'}
         filtered_issues = [
             #{k: v for k, v in issue.items() if k not in fields_to_exclude}
             {k: v for k, v in issue.items() if k in fields_to_include}
-            for issue in issues
+            for issue in self.iter_search_issues(query)
         ]
         
         return filtered_issues
 
+    # Method to iterate over every result of an issue search, page by page
+    def iter_search_issues(self, query):
+        search_url = 'https://api.github.com/search/issues'
+        # GitHub only serves the first 1000 results of a search
+        def on_page(page):
+            if page['total_count'] > 1000 or page.get('incomplete_results'):
+                print(f"Search found {page['total_count']} issues, results will be incomplete")
+        return self.client.paginate(search_url, params={'q': query}, headers=self.headers, items_key='items', on_page=on_page)
+
     # Method to get the latest successful workflow runs
     def get_latest_successful_workflow_runs(self, branch="release19"):
-        runs_url = f'{self.base_url}/actions/runs'
-        headers = {'Authorization': f'token {self.github_token}'}
-        response = requests.get(runs_url, headers=headers)
-        response.raise_for_status()
-        runs = response.json()['workflow_runs']
         status = 'completed'
         workflows = ['Xamarin Android Signed app', 'Xamarin Windows Signed app']
         branches = [branch]
-        #python parse date from string
-        print(runs)
-        valid_runs = [run for run in runs if run['status'] == status and run['name'] in workflows and run['head_branch'] in branches and datetime.strptime(run['created_at'], '%Y-%m-%dT%H:%M:%SZ') > datetime.now() - timedelta(days=1)]
+        since = datetime.utcnow() - timedelta(days=1)
+        valid_runs = []
+        for branch_name in branches:
+            # Branch, status and date are filtered by GitHub, the pages end with the time window
+            params = {'branch': branch_name, 'status': status, 'created': f">={since.strftime('%Y-%m-%dT%H:%M:%SZ')}"}
+            for run in self.iter_workflow_runs(params):
+                # The runs endpoint has no filter on the workflow name
+                if run['name'] in workflows:
+                    valid_runs.append(run)
         sorted_runs = sorted(valid_runs, key=lambda run: run['created_at'], reverse=True)
         for run in sorted_runs:
             #print(run)
@@ -282,14 +764,15 @@ class IssueDocumenter:
         print(sorted_runs)
         return sorted_runs
 
+    # Method to iterate over the workflow runs of the repository, newest first
+    def iter_workflow_runs(self, params=None):
+        runs_url = f'{self.base_url}/actions/runs'
+        return self.client.paginate(runs_url, params=params, headers=self.headers, items_key='workflow_runs')
+
     # Method to get the artifacts for a workflow run
     def get_artifacts_for_run(self, run_id):
         artifacts_url = f'{self.base_url}/actions/runs/{run_id}/artifacts'
-        headers = {'Authorization': f'token {self.github_token}'}
-        response = requests.get(artifacts_url, headers=headers)
-        response.raise_for_status()
-        artifacts = response.json()['artifacts']
-        return artifacts
+        return list(self.client.paginate(artifacts_url, headers=self.headers, items_key='artifacts'))
 
     # Method to document the artifacts for the latest successful workflow runs
     def document_artifacts(self):
@@ -297,16 +780,16 @@ class IssueDocumenter:
         # Now, get the latest successful workflow run
         latest_runs = self.get_latest_successful_workflow_runs()
         if latest_runs:
-            for run in latest_runs:
-                print(run)
-                # Get the artifacts for the latest successful run
-                artifacts = self.get_artifacts_for_run(run['id'])
-                print(artifacts)
-
-                # Add artifact download links to the document content
-                document_content.append(f"## Artifacts for the latest successful build (Run ID: {run['id']})\n")
-                for artifact in artifacts:
-                    document_content.append(f"- [{artifact['name']}]({artifact['archive_download_url']})\n")
+            # The artifacts of every run are fetched concurrently, the document keeps the order of the runs
+            with ThreadPoolExecutor(max_workers=min(DEFAULT_CONCURRENCY, len(latest_runs))) as executor:
+                run_artifacts = executor.map(self.get_artifacts_for_run, [run['id'] for run in latest_runs])
+                for run, artifacts in zip(latest_runs, run_artifacts):
+                    print(artifacts)
+
+                    # Add artifact download links to the document content
+                    document_content.append(f"## Artifacts for the latest successful build (Run ID: {run['id']})\n")
+                    for artifact in artifacts:
+                        document_content.append(f"- [{artifact['name']}]({artifact['archive_download_url']})\n")
         else:
             document_content.append("No successful workflow runs found.\n")
 
@@ -314,121 +797,93 @@ class IssueDocumenter:
 
     # Method to get the issues for a GitHub project
     def get_project_issues(self, project_number, org_name='' ):
-        # Get the project ID using the project number
-        projects_url = f'https://api.github.com/orgs/{org_name}/projects?per_page=100'
+        return list(self.iter_project_issues(project_number, org_name))
+
+    # Method to iterate over the issues of a classic GitHub project as their details arrive
+    # cards of every column are listed concurrently and the card contents are fetched concurrently
+    def iter_project_issues(self, project_number, org_name=''):
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.inertia-preview+json'
         }
-        page=1
-        while True:
-            print(f"Getting page {page}")
-            projects_response = requests.get(f"{projects_url}&page={page}"
-                                             , headers=headers)
-            projects_response.raise_for_status()
-            projects = projects_response.json()
-            if (len(projects) == 0):
-                raise ValueError(f"No more projects found for org: {org_name}")
-            
-            for project in projects:
-                print(f"Project: {project['name']}, number: {project['number']}")
-            
-            # Find the project with the given number
-            #project = next((p for p in projects if str(p['number']) == str(project_number)), None)
-            project = next((p for p in projects if str(p['number']) == str(project_number)), None)
-            if not project:
-                page = page + 1
-                #raise ValueError(f"No project found with number: {project_number}")
-            else:
-                break
-        
+        project_id = self.resolve_classic_project(project_number, org_name, headers)
+
+        columns_url = f'https://api.github.com/projects/{project_id}/columns'
+        columns = list(self.client.paginate(columns_url, headers=headers))
+
+        def list_cards(column):
+            return column, list(self.client.paginate(column['cards_url'], headers=headers))
+
+        def get_card_issue(card, column):
+            issue_response = self.client.cached_get(card['content_url'], headers=headers)
+            issue_response.raise_for_status()
+            issue = issue_response.json()
+            return {
+                'id': issue['id'],
+                'url': issue['html_url'],
+                'status': column['name']
+            }
 
-        # Now get the columns for the found project
-        columns_url = project['columns_url']
-        columns_response = requests.get(columns_url, headers=headers)
-        columns_response.raise_for_status()
-        columns = columns_response.json()
-
-        issues_info = []
-        for column in columns:
-            cards_url = column['cards_url']
-            cards_response = requests.get(cards_url, headers=headers)
-            cards_response.raise_for_status()
-            cards = cards_response.json()
-
-            for card in cards:
-                if 'content_url' in card and 'issue' in card['content_url']:
-                    issue_response = requests.get(card['content_url'], headers=headers)
-                    issue_response.raise_for_status()
-                    issue = issue_response.json()
-                    issues_info.append({
-                        'id': issue['id'],
-                        'url': issue['html_url'],
-                        'status': column['name']
-                    })
-
-        return issues_info
+        with ThreadPoolExecutor(max_workers=DEFAULT_CONCURRENCY) as executor:
+            issue_futures = []
+            for column, cards in executor.map(list_cards, columns):
+                for card in cards:
+                    if 'content_url' in card and 'issue' in card['content_url']:
+                        issue_futures.append(executor.submit(get_card_issue, card, column))
+            for future in as_completed(issue_futures):
+                yield future.result()
+
+    # Method to get the id of a classic GitHub project, cached in the project index
+    def resolve_classic_project(self, project_number, org_name, headers):
+        # Classic projects share numbers with the new projects of the same owner, keep them apart
+        owner = f'{org_name}/classic'
+        project = self.project_index.get_project(owner, project_number)
+        if project:
+            return project['project_id']
+
+        projects_url = f'https://api.github.com/orgs/{org_name}/projects'
+        for project in self.client.paginate(projects_url, headers=headers):
+            print(f"Project: {project['name']}, number: {project['number']}")
+            # Find the project with the given number
+            if str(project['number']) == str(project_number):
+                self.project_index.set_project(owner, project_number, str(project['id']), project['name'])
+                return str(project['id'])
+        raise ValueError(f"No project found with number: {project_number}")
 
     # Method to get the issues for a GitHub project using the GraphQL API
     def get_project_issues_graphql(self, project_number, org_name=None, user_name=None):
-        graphql_url = 'https://api.github.com/graphql'
-        headers = {
-            'Authorization': f'Bearer {self.github_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/vnd.github.vixen-preview+json'
-        }
+        issues = list(self.iter_project_issues_graphql(project_number, org_name, user_name))
+        #pprint(issues)
+        print(f"Found {len(issues)} issues")
+        return issues
 
+    # Method to iterate over the issues of a GitHub project, one page of 100 items at a time
+    def iter_project_issues_graphql(self, project_number, org_name=None, user_name=None):
         query = """
 query("""+(
         "$orgName: String!" if org_name else "$userName: String!"
-        )+""", $projectNumber: Int!) {
+        )+""", $projectNumber: Int!, $cursor: String) {
 """+ (
     """organization(login: $orgName)""" if org_name else """user(login: $userName)"""
     )+ """{
     projectV2(number: $projectNumber) {
         id
       	,title
-      	,items(first: 100) {
+      	,items(first: 100, after: $cursor) {
+      	  pageInfo {
+      	    hasNextPage,
+      	    endCursor
+      	  }
       	  edges {
       	    node {
-      	      id,
-              createdAt,
-              type,
-            	fieldValues(first: 20)
-              {
-                nodes{
-                ... on ProjectV2ItemFieldSingleSelectValue {
-                field {
-                  ... on ProjectV2SingleSelectField {
-                    name
-                  }
-                }
-                name
-                id
-              }
-                }},
-              content {
-                    ... on Issue {
-                      number,
-                      title,
-                      url,
-                      state,
-                      labels(first:10){
-                        nodes{
-                            name,
-                            color
-                        }
-                      }
-                    }
-              }
+      	      ...ProjectItemFields
       		}	
         }
     }
   }
 }
 }
-
-        """
+""" + PROJECT_ITEM_FRAGMENT
 
         variables = {
             'projectNumber': project_number
@@ -438,43 +893,101 @@ query("""+(
         else:
             variables['userName'] = user_name
 
-        response = requests.post(
-            graphql_url,
-            headers=headers,
-            json={'query': query, 'variables': variables}
-        )
-        response.raise_for_status()
-        result = response.json()
-
-        #make this a lambda function with validations for the cases where the data doesn't exist, so the index out of bound doesn't happen
-        def get_product(node):
-            if 'labels' in node['node']['content']:
-                product_labels = [label['name'] for label in node['node']['content']['labels']['nodes'] if label['name'].startswith('Product:')]
-                if product_labels and len(product_labels) > 0:
-                    return product_labels[0].split(':')[1]
-            return None
-
-        #print(result)
-        # Extract the issues from the result
-        issues = [
-            {
-                'id': node['node']['id'],
-                'number': node['node']['content']['number'],
-                'title': node['node']['content']['title'],
-                'url': node['node']['content']['url'],
-                'issue_status': node['node']['content']['state'],
-                'board_fields': node['node']['fieldValues']['nodes'],
-                'labels': node['node']['content']['labels']['nodes'],
-                'product': get_product(node),
-                #'product': [label['name'] for label in node['node']['content']['labels']['nodes'] if label['name'].startswith('Product:')][0].split(':')[1],
-                'board_status': [status['name'] for status in node['node']['fieldValues']['nodes'] if 'field' in status ][0]
+        # Extract the issues from each page as it arrives
+        edges = self.client.paginate_graphql(query, variables, ['organization' if org_name else 'user', 'projectV2', 'items'])
+        for node in edges:
+            if node['node']['type'] != 'ISSUE': # Ensure it's an Issue, not a PR or other content type
+                continue
+            yield parse_project_item(node['node'])
+
+    # Method to get the id of a GitHub project, cached in the project index
+    def resolve_project(self, project_number, org_name=None, user_name=None):
+        owner = org_name or user_name
+        project = self.project_index.get_project(owner, project_number)
+        if project:
+            return project['project_id']
+
+        entity = 'organization' if org_name else 'user'
+        project_query = """
+        query($owner: String!, $projectNumber: Int!) {
+            {entity}(login: $owner) {
+                projectV2(number: $projectNumber) {
+                    id
+                    title
+                }
             }
-            for node in result['data']['organization' if org_name else 'user']['projectV2']['items']['edges'] if node['node']['type'] == 'ISSUE' # Ensure it's an Issue, not a PR or other content type
-        ]
-
-        #pprint(issues)
-        print(f"Found {len(issues)} issues")
-        return issues
+        }
+        """.replace("{entity}", entity)
+        data = self.client.graphql(project_query, {'owner': owner, 'projectNumber': project_number})
+        project = data[entity]['projectV2']
+        self.project_index.set_project(owner, project_number, project['id'], project['title'])
+        return project['id']
+
+    # Method to bring the local project index up to date, returns the project id
+    # a light pass reads only item ids and timestamps, full details are fetched for the items that changed
+    def sync_project_index(self, project_number, org_name=None, user_name=None, force=False):
+        owner = org_name or user_name
+        project_id = self.resolve_project(project_number, org_name, user_name)
+        project = self.project_index.get_project(owner, project_number)
+        if not force and project['synced_at'] and time.time() - project['synced_at'] < PROJECT_INDEX_TTL:
+            return project_id
+
+        versions_query = """
+        query($projectId: ID!, $cursor: String) {
+            node(id: $projectId) {
+                ... on ProjectV2 {
+                    items(first: 100, after: $cursor) {
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                        nodes {
+                            id
+                            type
+                            updatedAt
+                            content {
+                                ... on Issue {
+                                    updatedAt
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+        """
+        stored_versions = self.project_index.item_versions(project_id)
+        seen_ids = set()
+        changed_ids = []
+        for item in self.client.paginate_graphql(versions_query, {'projectId': project_id}, ['node', 'items']):
+            if item['type'] != 'ISSUE':
+                continue
+            seen_ids.add(item['id'])
+            if stored_versions.get(item['id']) != project_item_updated_at(item):
+                changed_ids.append(item['id'])
+
+        self.refresh_project_items(project_id, changed_ids)
+
+        removed_ids = [item_id for item_id in stored_versions if item_id not in seen_ids]
+        self.project_index.delete_items(removed_ids)
+        self.project_index.mark_synced(owner, project_number)
+        print(f"Project {project_number} index synced: {len(changed_ids)} items updated, {len(removed_ids)} removed")
+        return project_id
+
+    # Method to fetch project items by id and store them in the project index
+    def refresh_project_items(self, project_id, item_ids):
+        items_query = """
+        query($ids: [ID!]!) {
+            nodes(ids: $ids) {
+                ...ProjectItemFields
+            }
+        }
+        """ + PROJECT_ITEM_FRAGMENT
+        for i in range(0, len(item_ids), 100):
+            data = self.client.graphql(items_query, {'ids': item_ids[i:i + 100]})
+            # Draft issues and pull requests are not on the issue boards
+            nodes = [node for node in data['nodes'] if node and node['type'] == 'ISSUE']
+            self.project_index.upsert_items(project_id, [parse_project_item(node) for node in nodes])
 
     # Method to create a tag on a GitHub repository
     def create_tag(self, tag_name, commit_sha):
@@ -493,7 +1006,7 @@ query("""+(
             'ref': f'refs/tags/{tag_name}',
             'sha': commit_sha
         }
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.client.post(url, headers=self.headers, json=data)
         response.raise_for_status()
         print(f'Created tag {tag_name}')
         return response.json()
@@ -501,7 +1014,7 @@ query("""+(
     # Method to retrieve a tag from a GitHub repository
     def retrive_tag(self, tag_name):
         url = f'{self.base_url}/git/refs/tags/{tag_name}'
-        response = requests.get(url, headers=self.headers)
+        response = self.client.cached_get(url, headers=self.headers)
         if response.status_code != 200:
             print(f'Tag {tag_name} not found')
             return None
@@ -512,14 +1025,14 @@ query("""+(
     # Method to delete a tag from a GitHub repository
     def delete_tag(self, tag_name):
         url = f'{self.base_url}/git/refs/tags/{tag_name}'
-        response = requests.delete(url, headers=self.headers)
+        response = self.client.delete(url, headers=self.headers)
         response.raise_for_status()
         return response.status_code == 204
 
     # Method to retrieve a release from a GitHub repository
     def retrieve_release(self, tag_name):
         url = f'{self.base_url}/releases/tags/{tag_name}'
-        response = requests.get(url, headers=self.headers)
+        response = self.client.cached_get(url, headers=self.headers)
         if response.status_code != 200:
             print(f'Release for tag {tag_name} not found')
             return None
@@ -529,10 +1042,7 @@ query("""+(
 
     # Method to list all releases for a GitHub repository
     def list_all_releases(self, prerelease=True):
-        url = f'{self.base_url}/releases'
-        response = requests.get(url, headers=self.headers)
-        response.raise_for_status()
-        releases = response.json()
+        releases = list(self.iter_releases())
         sorted_releases = sorted(releases, key=lambda release: release['created_at'], reverse=True)
         filtered_releases = [release for release in sorted_releases if release['prerelease'] == prerelease]
         result = [{
@@ -544,6 +1054,11 @@ query("""+(
         } for release in filtered_releases]
         return result
 
+    # Method to iterate over every release of the repository, page by page
+    def iter_releases(self):
+        url = f'{self.base_url}/releases'
+        return self.client.paginate(url, headers=self.headers)
+
     # Method to create a release on a GitHub repository
     def create_release(self, tag_name, release_name, body):
         release_info = self.retrieve_release(tag_name)
@@ -558,7 +1073,7 @@ query("""+(
             'body': body,
             'prerelease': True
         }
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.client.post(url, headers=self.headers, json=data)
         print(response.json())
         response.raise_for_status()
         return response.json()
@@ -567,7 +1082,7 @@ query("""+(
     def add_release_notes(self, release_id, body):
         url = f'{self.base_url}/releases/{release_id}'
         data = {'body': body}
-        response = requests.patch(url, headers=self.headers, json=data)
+        response = self.client.patch(url, headers=self.headers, json=data)
         response.raise_for_status()
         return response.json()
 
@@ -575,14 +1090,14 @@ query("""+(
     def add_comment_to_issue(self, issue_number, comment):
         url = f'{self.base_url}/issues/{issue_number}/comments'
         data = {'body': comment}
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.client.post(url, headers=self.headers, json=data)
         response.raise_for_status()
         return response.json()
 
     # Method to get the last commit in a GitHub repository
     def get_last_commit(self):
         url = f'{self.base_url}/commits'
-        response = requests.get(url, headers=self.headers)
+        response = self.client.get(url, headers=self.headers)
         response.raise_for_status()
         commits = response.json()
         if commits:
@@ -590,6 +1105,91 @@ query("""+(
         else:
             raise Exception("No commits found in the repository")
 
+#make this a lambda function with validations for the cases where the data doesn't exist, so the index out of bound doesn't happen
+def get_product(node):
+    if 'labels' in node['content']:
+        return product_from_labels([label['name'] for label in node['content']['labels']['nodes']])
+    return None
+
+# Function to get the product of an issue from its first Product:<name> label
+def product_from_labels(label_names):
+    product_labels = [name for name in label_names if name.startswith('Product:')]
+    if product_labels:
+        return product_labels[0].split(':')[1]
+    return None
+
+# Function to get when a project item last changed, either on the board or in the issue itself
+def project_item_updated_at(node):
+    content_updated_at = (node.get('content') or {}).get('updatedAt') or ''
+    return max(node['updatedAt'], content_updated_at)
+
+# Function to convert a project item node into the issue dictionary used by the board tools
+def parse_project_item(node):
+    board_statuses = [status['name'] for status in node['fieldValues']['nodes'] if 'field' in status]
+    return {
+        'id': node['id'],
+        'number': node['content']['number'],
+        'title': node['content']['title'],
+        'url': node['content']['url'],
+        'issue_status': node['content']['state'],
+        'board_fields': node['fieldValues']['nodes'],
+        'labels': node['content']['labels']['nodes'],
+        'product': get_product(node),
+        #'product': [label['name'] for label in node['content']['labels']['nodes'] if label['name'].startswith('Product:')][0].split(':')[1],
+        'board_status': board_statuses[0] if board_statuses else None,
+        'updated_at': project_item_updated_at(node)
+    }
+
+# Function to convert an issue fetched through GraphQL into the shape of the REST API, as used by the markdown builder
+def graphql_issue_to_rest(node):
+    return {
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'state': node['state'].lower(),
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        # Deleted accounts have no author
+        'user': {'login': node['author']['login'] if node['author'] else 'ghost'},
+        'labels': node['labels']['nodes']
+    }
+
+def graphql_comment_to_rest(node):
+    return {
+        'id': node['databaseId'],
+        'body': node['body'],
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'user': {'login': node['author']['login'] if node['author'] else 'ghost'}
+    }
+
+# Function to get the image sources and link targets of a comment body
+def extract_comment_links(body):
+    if not TAG_PATTERN.search(body):
+        return [], []
+    # Imported here, most comments have no tags and BeautifulSoup is slow to import
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(body, HTML_PARSER)
+    img_urls = [img['src'] for img in soup.find_all('img') if img.get('src')]
+    link_urls = [link['href'] for link in soup.find_all('a') if link.get('href')]
+    return img_urls, link_urls
+
+# Function to build the vector database entry for an issue document
+# the metadata carries what the similarity queries filter on, every label is a flag since metadata values cannot be lists
+def issue_vector_document(issue, content, repo_owner, repo_name):
+    label_names = [label['name'] for label in issue['labels']]
+    metadata = {
+        "source": "github",
+        "issue_number": issue['number'],
+        "repo": f"{repo_owner}/{repo_name}",
+        "state": issue['state'].lower(),
+        "created_at": issue['created_at'],
+        "created_at_ts": timestamp(issue['created_at']),
+        "labels": ', '.join(label_names)
+    }
+    metadata.update({label_key(name): True for name in label_names})
+    return {"document": content, "metadata": metadata, "id": issue_doc_id(repo_owner, repo_name, issue['number'])}
+
 # Function to document a GitHub issue
 def document_github_issue(issue_number, repo=None):
     load_dotenv()
@@ -603,6 +1203,15 @@ def document_github_issue(issue_number, repo=None):
     #result = documenter.get_project_issues_graphql(issue_number)
     return result
 
+# Function to document several GitHub issues with batched GraphQL requests
+def document_github_issues_batch(issue_numbers, repo=None):
+    load_dotenv()
+    github_token = os.getenv('GITHUB_TOKEN')
+    repo_owner = os.getenv('REPO_OWNER')
+    repo_name = os.getenv('REPO_NAME') if not repo else repo
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    return documenter.document_issues(issue_numbers)
+
 # Function to search for GitHub issues
 def search_issues(status: str = 'open', product: str = None, repo_name: str = 'eng-product-release'):
     load_dotenv()
@@ -630,14 +1239,25 @@ def list_github_issues(project_number: int, status=None, product=None):
     #result = documenter.document_issue()
     #result = documenter.document_artifacts()
     #result = documenter.get_project_issues(issue_number)
-    result = documenter.get_project_issues_graphql(project_number, repo_owner if is_org else None, repo_owner if not is_org else None)
-    if status and status.lower() != 'all':
-        result = [item for item in result if item['board_status'].lower() == status.lower()]
-    if product and product.lower() != 'all' and product.lower() != 'maintenance':
-        result = [item for item in result if item['product'].lower() == product.lower()]
+    # Answer from the local index, only the items that changed since the last sync are fetched
+    project_id = documenter.sync_project_index(project_number, repo_owner if is_org else None, repo_owner if not is_org else None)
+    if product and product.lower() == 'maintenance':
+        product = None
+    result = documenter.project_index.query(project_id, board_status=status, product=product)
     print(f"Found {len(result)} issues in status {status}")
     return result
 
+# Function to count the issues of a project in each board status
+def count_github_issues_by_status(project_number: int):
+    load_dotenv()
+    github_token = os.getenv('GITHUB_TOKEN')
+    is_org = os.getenv('IS_ORG') == 'true'
+    repo_owner = os.getenv('REPO_OWNER')
+    repo_name = os.getenv('REPO_NAME')
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    project_id = documenter.sync_project_index(project_number, repo_owner if is_org else None, repo_owner if not is_org else None)
+    return documenter.project_index.count_by_status(project_id)
+
 # Function to create or update a release on GitHub
 def create_or_update_release(product:str = None, build_tag:str = None, release_notes:str = None):
     #for tests
@@ -691,7 +1311,7 @@ def add_comment_to_issue(issue_number:int, comment:str, repo_name:str = None):
     headers = {'Authorization': f'token {github_token}'}
     data = {'body': comment}
 
-    response = requests.post(issue_url, headers=headers, json=data)
+    response = documenter.client.post(issue_url, headers=headers, json=data)
     response.raise_for_status()
     return response.json()
 
@@ -724,7 +1344,35 @@ def list_all_releases(product:str = None):
     return releases
 
 # Function to get similar issues from the vector database
-def get_similar_issues(issue_number:int, repo_name:str = None):
+def get_similar_issues(issue_number:int, repo_name:str = None, state:str = None, labels:list = None, created_after:str = None, created_before:str = None):
+    if not issue_number:
+        raise Exception('Issue number must be provided')
+
+    load_dotenv()
+    github_token = os.getenv('GITHUB_TOKEN')
+    repo_owner = os.getenv('REPO_OWNER')
+    if not repo_name:
+        repo_name = os.getenv('MAINTENANCE_REPO')
+
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name, issue_number)
+    return documenter.get_similar_issues(state, labels, created_after, created_before)
+
+# Function to search the issue documents of a repository for a free text query
+def search_issue_documents(query:str, repo_name:str = None, mode:str = 'hybrid', n_results:int = 5):
+    if not query:
+        raise Exception('A query must be provided')
+
+    load_dotenv()
+    github_token = os.getenv('GITHUB_TOKEN')
+    repo_owner = os.getenv('REPO_OWNER')
+    if not repo_name:
+        repo_name = os.getenv('MAINTENANCE_REPO')
+
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    return documenter.search_issue_documents(query, mode, n_results)
+
+# Function to get the issues that are likely duplicates of an issue
+def get_likely_duplicates(issue_number:int, repo_name:str = None):
     if not issue_number:
         raise Exception('Issue number must be provided')
 
@@ -735,17 +1383,35 @@ def get_similar_issues(issue_number:int, repo_name:str = None):
         repo_name = os.getenv('MAINTENANCE_REPO')
 
     documenter = IssueDocumenter(github_token, repo_owner, repo_name, issue_number)
-    return documenter.get_similar_issues()
+    return documenter.get_likely_duplicates()
+
+# Function to get the similar issues of many issues at once, e.g. to triage a backlog
+def get_similar_issues_batch(issue_numbers:list, repo_name:str = None, state:str = None):
+    if not issue_numbers:
+        raise Exception('Issue numbers must be provided')
+
+    load_dotenv()
+    github_token = os.getenv('GITHUB_TOKEN')
+    repo_owner = os.getenv('REPO_OWNER')
+    if not repo_name:
+        repo_name = os.getenv('MAINTENANCE_REPO')
+
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    return documenter.get_similar_issues_batch(issue_numbers, state)
 
 # Function to update the status of a GitHub issue
 def update_issue_status(issue_number:int, status:str):
+    update_issues_status([issue_number], status)
+
+# Function to update the status of several GitHub issues at once
+def update_issues_status(issue_numbers:list, status:str):
     load_dotenv()
     github_token = os.getenv('GITHUB_TOKEN')
     repo_owner = os.getenv('REPO_OWNER')
     repo_name = os.getenv('MAINTENANCE_REPO')
     project_number = 1
-    documenter = IssueDocumenter(github_token, repo_owner, repo_name, issue_number)
-    documenter.update_issue_status(issue_number, status, project_number, None, repo_owner)
+    documenter = IssueDocumenter(github_token, repo_owner, repo_name)
+    documenter.update_issues_status(issue_numbers, status, project_number, None, repo_owner)
 
 # Usage as a library
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+import os
+import re
+
+ISSUES_DIRECTORY = 'issues'
+DOCUMENT_FILE_PATTERN = re.compile(r'^issue_(\d+)_documentation\.md$')
+# Separator and heading that end the header of an issue document, the comments section follows
+# comments are blockquoted so none of their lines can start with the separator
+COMMENTS_SEPARATOR = '-------------------------------------\n\n## Comments\n'
+
+
+# Function to get the id of an issue document in the vector database and the search indexes
+# issue numbers are only unique within a repository, the id carries both like the issue state keys
+def issue_doc_id(repo_owner, repo_name, issue_number):
+    return f'{repo_owner}/{repo_name}#{issue_number}'
+
+
+# Function to get the id issue documents were stored with before the repository was part of it
+def legacy_issue_doc_id(issue_number):
+    return f'issue_{issue_number}'
+
+
+# Function to get the path of the markdown document of an issue, the documents of each repository have their own folder
+def issue_document_path(repo_owner, repo_name, issue_number, directory=ISSUES_DIRECTORY):
+    return os.path.join(directory, repo_owner, repo_name, f'issue_{issue_number}_documentation.md')
+
+
+# Function to iterate over the saved issue documents, yields the repository owner and name, the issue number and the path
+def iter_issue_document_files(directory=ISSUES_DIRECTORY):
+    for repo_owner in sorted(os.listdir(directory)):
+        owner_directory = os.path.join(directory, repo_owner)
+        if not os.path.isdir(owner_directory):
+            continue
+        for repo_name in sorted(os.listdir(owner_directory)):
+            repo_directory = os.path.join(owner_directory, repo_name)
+            if not os.path.isdir(repo_directory):
+                continue
+            for filename in sorted(os.listdir(repo_directory)):
+                file_match = DOCUMENT_FILE_PATTERN.match(filename)
+                if file_match:
+                    yield repo_owner, repo_name, int(file_match.group(1)), os.path.join(repo_directory, filename)
+
+
+# Function to get where the comments section of an issue document starts, -1 when the document has no comments section
+# header_length comes from the issue state, the description may itself contain the separator
+def comments_offset(content, header_length=None):
+    if header_length and content[:header_length].endswith(COMMENTS_SEPARATOR):
+        return header_length
+    separator_start = content.find(COMMENTS_SEPARATOR)
+    return -1 if separator_start == -1 else separator_start + len(COMMENTS_SEPARATOR)
+
+
+# Function to get the title and description of an issue document, the part a duplicate report would repeat
+def issue_report_text(content):
+    comments_start = comments_offset(content)
+    header = content if comments_start == -1 else content[:comments_start - len(COMMENTS_SEPARATOR)]
+    title = header.split('\n', 1)[0]
+    description = header.split('## Description\n', 1)[-1]
+    return f'{title}\n{description}'
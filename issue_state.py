@@ -0,0 +1,84 @@
+import json
+import os
+from contextlib import contextmanager
+from sqlite_store import SQLiteStore, SharedInstance
+
+DEFAULT_STATE_PATH = os.getenv('ISSUE_STATE_PATH', os.path.join('data', 'issue_state.sqlite'))
+# States were kept in one JSON file before, it is imported once and renamed
+LEGACY_STATE_PATH = os.path.join('data', 'issue_state.json')
+
+
+# Remembers, for every documented issue, its updated_at, the comments already documented and the content hash
+# one row per issue, only the issues asked for are read and only the ones set are written
+class IssueStateStore(SQLiteStore):
+    def __init__(self, path=DEFAULT_STATE_PATH, legacy_path=LEGACY_STATE_PATH):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS issue_states (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+        """)
+        # Committing is deferred while a batch is open, see batch()
+        self.batch_depth = 0
+        if legacy_path and os.path.exists(legacy_path):
+            self.import_json(legacy_path)
+
+    @staticmethod
+    def make_key(repo_owner, repo_name, issue_number):
+        return f'{repo_owner}/{repo_name}#{issue_number}'
+
+    def get(self, repo_owner, repo_name, issue_number):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT state FROM issue_states WHERE key = ?', (self.make_key(repo_owner, repo_name, issue_number),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, repo_owner, repo_name, issue_number, state):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO issue_states (key, state) VALUES (?, ?)',
+                (self.make_key(repo_owner, repo_name, issue_number), json.dumps(state))
+            )
+            if not self.batch_depth:
+                self.connection.commit()
+
+    def delete(self, repo_owner, repo_name, issue_number):
+        with self.lock:
+            self.connection.execute('DELETE FROM issue_states WHERE key = ?', (self.make_key(repo_owner, repo_name, issue_number),))
+            if not self.batch_depth:
+                self.connection.commit()
+
+    # Context manager to commit many set() calls in one transaction, e.g. a page of a backfill
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self.batch_depth += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.batch_depth -= 1
+                if not self.batch_depth:
+                    self.connection.commit()
+
+    # Method to import the states of the former JSON file, the file is renamed once imported
+    def import_json(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            states = json.load(f)
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO issue_states (key, state) VALUES (?, ?)',
+                [(key, json.dumps(state)) for key, state in states.items()]
+            )
+            self.connection.commit()
+        os.replace(path, f'{path}.imported')
+        print(f"Imported {len(states)} issue states from {path}")
+
+
+# Shared state store, opened on first use
+_store = SharedInstance(IssueStateStore)
+
+
+def get_issue_state_store():
+    return _store.get()
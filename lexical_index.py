@@ -0,0 +1,115 @@
+import argparse
+import os
+import re
+from issue_files import ISSUES_DIRECTORY, issue_doc_id, iter_issue_document_files
+from sqlite_store import SQLiteStore, SharedInstance
+
+DEFAULT_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', os.path.join('data', 'lexical_index.sqlite'))
+# Constant of reciprocal rank fusion, a larger value flattens the advantage of the first ranks
+RRF_K = 60
+
+
+# Full-text index of the issue documents, ranked with BM25 by SQLite FTS5
+# catches exact strings the embeddings miss, like error codes, stack frames and issue numbers
+class LexicalIndex(SQLiteStore):
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL UNIQUE,
+                repo TEXT,
+                issue_number INTEGER
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(content, tokenize="unicode61 tokenchars '_'");
+            CREATE INDEX IF NOT EXISTS documents_repo ON documents (repo);
+        """)
+
+    # Method to insert or replace the text of documents, each a dict with id, document and metadata like the vector database entries
+    def upsert_documents(self, docs):
+        with self.lock:
+            for doc in docs:
+                metadata = doc['metadata']
+                self.connection.execute(
+                    'INSERT INTO documents (doc_id, repo, issue_number) VALUES (?, ?, ?) '
+                    'ON CONFLICT (doc_id) DO UPDATE SET repo = excluded.repo, issue_number = excluded.issue_number',
+                    (doc['id'], metadata.get('repo'), metadata.get('issue_number'))
+                )
+                rowid = self.connection.execute('SELECT id FROM documents WHERE doc_id = ?', (doc['id'],)).fetchone()[0]
+                self.connection.execute('DELETE FROM documents_fts WHERE rowid = ?', (rowid,))
+                self.connection.execute('INSERT INTO documents_fts (rowid, content) VALUES (?, ?)', (rowid, doc['document']))
+            self.connection.commit()
+
+    def delete_documents(self, doc_ids):
+        with self.lock:
+            for doc_id in doc_ids:
+                row = self.connection.execute('SELECT id FROM documents WHERE doc_id = ?', (doc_id,)).fetchone()
+                if row:
+                    self.connection.execute('DELETE FROM documents_fts WHERE rowid = ?', (row[0],))
+                    self.connection.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+            self.connection.commit()
+
+    # Method to find the documents matching any word of the query, best BM25 score first
+    def search(self, query, n_results=10, repo=None):
+        match = to_match_expression(query)
+        if not match:
+            return []
+        sql = ('SELECT d.doc_id, d.repo, d.issue_number, bm25(documents_fts) AS score, '
+               "snippet(documents_fts, 0, '**', '**', '...', 16) AS snippet "
+               'FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid WHERE documents_fts MATCH ?')
+        params = [match]
+        if repo:
+            sql += ' AND d.repo = ?'
+            params.append(repo)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(n_results)
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        # FTS5 scores are negative, the lower the better
+        return [{"id": doc_id, "repo": repo, "issue_number": issue_number, "score": score, "snippet": snippet}
+                for doc_id, repo, issue_number, score, snippet in rows]
+
+    # Method to index the saved issue documents of every repository, e.g. the ones written before the index existed
+    def index_directory(self, directory=ISSUES_DIRECTORY):
+        indexed = 0
+        for repo_owner, repo_name, issue_number, path in iter_issue_document_files(directory):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            self.upsert_documents([{
+                "id": issue_doc_id(repo_owner, repo_name, issue_number),
+                "document": content,
+                "metadata": {"repo": f"{repo_owner}/{repo_name}", "issue_number": issue_number}
+            }])
+            indexed += 1
+        return indexed
+
+
+# Function to turn free text into an FTS5 query matching any of its words, so user input cannot break the query syntax
+def to_match_expression(query):
+    words = re.findall(r'\w+', query)
+    return ' OR '.join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+# Function to fuse several rankings of document ids into one, with reciprocal rank fusion
+# returns (id, score) pairs, best first
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+
+# Shared index, opened on first use
+_index = SharedInstance(LexicalIndex)
+
+
+def get_lexical_index():
+    return _index.get()
+
+
+# Index the issue documents already saved in the issues folder
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add the saved issue documents to the full-text index')
+    parser.add_argument('--directory', default=ISSUES_DIRECTORY, help='folder with one subfolder per repository owner and name')
+    args = parser.parse_args()
+    print(f"Indexed {get_lexical_index().index_directory(args.directory)} documents")
@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv
-from code_assistant import start_agent
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -13,4 +12,6 @@ if not use_console:
     import web_app
 # If in console mode, start the agent
 elif __name__ == "__main__":
+    # Imported here so each mode only loads the modules it needs
+    from code_assistant import start_agent
     start_agent()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import time
+from sqlite_store import SQLiteStore, SharedInstance
+
+DEFAULT_INDEX_PATH = os.getenv('PROJECT_INDEX_PATH', os.path.join('data', 'project_index.sqlite'))
+# Seconds during which the index is trusted without asking GitHub for changes
+DEFAULT_SYNC_TTL = float(os.getenv('PROJECT_INDEX_TTL', 300))
+
+
+# Local copy of the issues on GitHub project boards, kept in sync incrementally by updatedAt
+class ProjectIndex(SQLiteStore):
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS projects (
+                owner TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                project_id TEXT NOT NULL,
+                title TEXT,
+                synced_at REAL,
+                PRIMARY KEY (owner, number)
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                item_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                number INTEGER,
+                title TEXT,
+                url TEXT,
+                issue_status TEXT COLLATE NOCASE,
+                board_status TEXT COLLATE NOCASE,
+                product TEXT COLLATE NOCASE,
+                updated_at TEXT,
+                labels TEXT,
+                board_fields TEXT
+            );
+            CREATE TABLE IF NOT EXISTS fields (
+                project_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                field_id TEXT NOT NULL,
+                options TEXT NOT NULL,
+                PRIMARY KEY (project_id, name)
+            );
+            CREATE INDEX IF NOT EXISTS items_board_status ON items (project_id, board_status);
+            CREATE INDEX IF NOT EXISTS items_product ON items (project_id, product);
+            CREATE INDEX IF NOT EXISTS items_issue_status ON items (project_id, issue_status);
+            CREATE INDEX IF NOT EXISTS items_number ON items (project_id, number);
+            CREATE INDEX IF NOT EXISTS items_url ON items (url);
+        """, row_factory=sqlite3.Row)
+
+    # Method to get the stored project for an owner and project number, returns None when unknown
+    def get_project(self, owner, number):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT project_id, title, synced_at FROM projects WHERE owner = ? AND number = ?', (owner, number)
+            ).fetchone()
+        return dict(row) if row else None
+
+    # Method to check whether the items of a project are kept in the index
+    def has_project(self, project_id):
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+        return row is not None
+
+    def set_project(self, owner, number, project_id, title=None):
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO projects (owner, number, project_id, title) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (owner, number) DO UPDATE SET project_id = excluded.project_id, title = COALESCE(excluded.title, projects.title)',
+                (owner, number, project_id, title)
+            )
+            self.connection.commit()
+
+    def mark_synced(self, owner, number):
+        with self.lock:
+            self.connection.execute('UPDATE projects SET synced_at = ? WHERE owner = ? AND number = ?', (time.time(), owner, number))
+            self.connection.commit()
+
+    # Method to get a stored single select field with its options, returns None when unknown
+    def get_field(self, project_id, name):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT field_id, options FROM fields WHERE project_id = ? AND name = ?', (project_id, name)
+            ).fetchone()
+        return {'id': row['field_id'], 'options': json.loads(row['options'])} if row else None
+
+    def set_field(self, project_id, name, field_id, options):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO fields (project_id, name, field_id, options) VALUES (?, ?, ?, ?)',
+                (project_id, name, field_id, json.dumps(options))
+            )
+            self.connection.commit()
+
+    # Method to map issue numbers to their item ids in a project, numbers not on the board are left out
+    def find_items(self, project_id, issue_numbers):
+        issue_numbers = list(issue_numbers)
+        if not issue_numbers:
+            return {}
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT number, item_id FROM items WHERE project_id = ? AND number IN ({", ".join("?" for _ in issue_numbers)})',
+                [project_id] + issue_numbers
+            ).fetchall()
+        return {row['number']: row['item_id'] for row in rows}
+
+    # Method to record a board status change made through the API
+    def set_board_status(self, item_ids, board_status):
+        with self.lock:
+            self.connection.executemany(
+                'UPDATE items SET board_status = ? WHERE item_id = ?', [(board_status, item_id) for item_id in item_ids]
+            )
+            self.connection.commit()
+
+    # Method to get the updatedAt of every stored item of a project
+    def item_versions(self, project_id):
+        with self.lock:
+            rows = self.connection.execute('SELECT item_id, updated_at FROM items WHERE project_id = ?', (project_id,)).fetchall()
+        return {row['item_id']: row['updated_at'] for row in rows}
+
+    # Method to insert or replace project items, they have the shape returned by get_project_issues_graphql
+    def upsert_items(self, project_id, items):
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO items (item_id, project_id, number, title, url, issue_status, board_status, product, updated_at, labels, board_fields) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(
+                    item['id'], project_id, item['number'], item['title'], item['url'], item['issue_status'],
+                    item['board_status'], item['product'], item['updated_at'],
+                    json.dumps(item['labels']), json.dumps(item['board_fields'])
+                ) for item in items]
+            )
+            self.connection.commit()
+
+    # Method to apply the details of an issue to every item showing it, e.g. after an issues webhook event
+    # items are matched by the issue URL since issue numbers repeat across repositories, returns the number of items updated
+    def update_issue(self, url, title, issue_status, labels, product, updated_at):
+        with self.lock:
+            cursor = self.connection.execute(
+                'UPDATE items SET title = ?, issue_status = ?, labels = ?, product = ?, updated_at = MAX(COALESCE(updated_at, \'\'), ?) WHERE url = ?',
+                (title, issue_status, json.dumps(labels), product, updated_at, url)
+            )
+            self.connection.commit()
+        return cursor.rowcount
+
+    # Method to remove the items showing an issue, e.g. once it was deleted or transferred to another repository
+    def delete_issue_items(self, url):
+        with self.lock:
+            self.connection.execute('DELETE FROM items WHERE url = ?', (url,))
+            self.connection.commit()
+
+    def delete_items(self, item_ids):
+        with self.lock:
+            self.connection.executemany('DELETE FROM items WHERE item_id = ?', [(item_id,) for item_id in item_ids])
+            self.connection.commit()
+
+    # Method to query the issues of a project, filters are case insensitive and None or 'all' means no filter
+    def query(self, project_id, board_status=None, product=None, issue_status=None):
+        conditions = ['project_id = ?']
+        params = [project_id]
+        for column, value in (('board_status', board_status), ('product', product), ('issue_status', issue_status)):
+            if value and value.lower() != 'all':
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT * FROM items WHERE {" AND ".join(conditions)} ORDER BY number', params
+            ).fetchall()
+        return [{
+            'id': row['item_id'],
+            'number': row['number'],
+            'title': row['title'],
+            'url': row['url'],
+            'issue_status': row['issue_status'],
+            'board_fields': json.loads(row['board_fields']),
+            'labels': json.loads(row['labels']),
+            'product': row['product'],
+            'board_status': row['board_status'],
+            'updated_at': row['updated_at']
+        } for row in rows]
+
+    # Method to count the issues of a project in each board status
+    def count_by_status(self, project_id):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT board_status, COUNT(*) AS total FROM items WHERE project_id = ? GROUP BY board_status ORDER BY board_status',
+                (project_id,)
+            ).fetchall()
+        return {row['board_status']: row['total'] for row in rows}
+
+
+# Shared index, opened on first use
+_index = SharedInstance(ProjectIndex)
+
+
+def get_project_index():
+    return _index.get()
@@ -0,0 +1,147 @@
+import calendar
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Request priorities, interactive agent calls are served before background bulk jobs
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Defaults for the scheduler, can be overridden from the environment
+DEFAULT_REQUESTS_PER_SECOND = float(os.getenv('GITHUB_REQUESTS_PER_SECOND', 10))
+DEFAULT_BURST = int(os.getenv('GITHUB_BURST', 20))
+DEFAULT_BULK_RESERVE = int(os.getenv('GITHUB_BULK_RESERVE', 500))
+MAX_RETRIES = int(os.getenv('GITHUB_MAX_RETRIES', 5))
+# GitHub asks to wait at least a minute after a secondary rate limit without Retry-After
+SECONDARY_LIMIT_WAIT = 60
+
+_priority = contextvars.ContextVar('github_request_priority', default=INTERACTIVE)
+
+
+# Context manager to mark every GitHub request made inside it as background bulk work
+@contextmanager
+def bulk_priority():
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+# Raised when GitHub rejects a request because of a rate limit, carries the response to return on give up
+class RateLimitedError(Exception):
+    def __init__(self, response):
+        super().__init__(f'GitHub rate limit hit with status {response.status_code}')
+        self.response = response
+
+
+class RateLimitScheduler:
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST, bulk_reserve=DEFAULT_BULK_RESERVE):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        # Bulk requests leave part of the bucket and of the hourly budget to interactive requests
+        self.bulk_bucket_reserve = burst / 4
+        self.bulk_reserve = bulk_reserve
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        # Remaining budget and reset time per GitHub resource (core, search, graphql)
+        self.remaining = {}
+        self.reset_at = {}
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    # Method to reserve a slot for a request, returns the seconds to wait before trying again or 0 when the request can go
+    def reserve(self, resource, priority):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.requests_per_second)
+            self.refilled_at = now
+
+            if self.blocked_until > now:
+                return self.blocked_until - now
+
+            remaining = self.remaining.get(resource)
+            reset_at = self.reset_at.get(resource, 0)
+            budget_floor = self.bulk_reserve if priority == BULK else 0
+            if remaining is not None and remaining <= budget_floor and reset_at > time.time():
+                return reset_at - time.time()
+
+            bucket_floor = self.bulk_bucket_reserve if priority == BULK else 0
+            if self.tokens - 1 < bucket_floor:
+                return (bucket_floor + 1 - self.tokens) / self.requests_per_second
+
+            self.tokens -= 1
+            if remaining is not None:
+                self.remaining[resource] = remaining - 1
+            return 0
+
+    # Method to wait until a request can be sent
+    def acquire(self, resource, priority=None):
+        priority = priority or current_priority()
+        while True:
+            wait = self.reserve(resource, priority)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    # Method to record the rate limit headers of a response, returns True when the request was rate limited
+    def update(self, resource, status_code, headers, body=''):
+        with self.lock:
+            resource = headers.get('X-RateLimit-Resource', resource)
+            if 'X-RateLimit-Remaining' in headers:
+                self.remaining[resource] = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                self.reset_at[resource] = int(headers['X-RateLimit-Reset'])
+
+            if status_code not in (403, 429):
+                return False
+            if 'Retry-After' in headers:
+                wait = int(headers['Retry-After'])
+            elif headers.get('X-RateLimit-Remaining') == '0':
+                wait = max(self.reset_at.get(resource, 0) - time.time(), 0) + 1
+            elif status_code == 429 or 'rate limit' in body.lower():
+                wait = SECONDARY_LIMIT_WAIT
+            else:
+                # A plain 403, e.g. missing permissions
+                return False
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+            print(f'GitHub rate limit hit on {resource}, pausing requests for {int(wait)} seconds')
+            return True
+
+    # Method to record the rateLimit object returned by a GraphQL query
+    def update_graphql_cost(self, rate_limit):
+        with self.lock:
+            self.remaining['graphql'] = rate_limit['remaining']
+            if 'resetAt' in rate_limit:
+                self.reset_at['graphql'] = calendar.timegm(time.strptime(rate_limit['resetAt'], '%Y-%m-%dT%H:%M:%SZ'))
+            if 'cost' in rate_limit:
+                print(f"GraphQL query cost {rate_limit['cost']}, {rate_limit['remaining']} points remaining")
+
+
+# Function to get the GitHub resource a URL counts against
+def resource_for_url(url):
+    if url.endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in url:
+        return 'search'
+    return 'core'
+
+
+# One scheduler per token, the rate limit budget belongs to the token
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_rate_limit_scheduler(github_token):
+    with _schedulers_lock:
+        scheduler = _schedulers.get(github_token)
+        if scheduler is None:
+            scheduler = RateLimitScheduler()
+            _schedulers[github_token] = scheduler
+        return scheduler
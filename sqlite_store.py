@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import threading
+
+
+# Base of the stores kept in a local SQLite file, like the search indexes, the caches and the issue states
+# the folder of the file is created and the schema applied when the store is opened
+# one connection is shared by every thread, the methods of a store hold its lock while they use it
+class SQLiteStore:
+    def __init__(self, path, schema, row_factory=None):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        if row_factory:
+            self.connection.row_factory = row_factory
+        self.connection.executescript(schema)
+        self.connection.commit()
+
+
+# Instance shared by the whole process, created by the factory on first use
+class SharedInstance:
+    def __init__(self, factory):
+        self.factory = factory
+        self.instance = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.instance is None:
+                self.instance = self.factory()
+            return self.instance
@@ -1,53 +1,294 @@
-import chromadb
-from chromadb.config import Settings
+import calendar
+import os
+import re
+import time
+from datetime import datetime
+
+# Number of documents embedded and written together, capped by the maximum batch size of the Chroma client
+DEFAULT_BATCH_SIZE = int(os.getenv('VECTOR_DB_BATCH_SIZE', 64))
+# Characters per chunk of a markdown document, the embedding model only reads the first few hundred tokens of a text
+CHUNK_SIZE = int(os.getenv('VECTOR_DB_CHUNK_SIZE', 1000))
+# Characters repeated at the start of the next chunk when a section is split
+CHUNK_OVERLAP = int(os.getenv('VECTOR_DB_CHUNK_OVERLAP', 200))
+# Chunks fetched per requested document when hits are grouped by document
+CHUNK_QUERY_FACTOR = 5
+# Chunks of a document used as queries when searching documents similar to it, the title and description come first
+MAX_QUERY_CHUNKS = int(os.getenv('VECTOR_DB_MAX_QUERY_CHUNKS', 4))
+# Each comment of an issue document starts a new section
+SECTION_PATTERN = re.compile(r'\n(?=### Comment by )')
+# 'hnsw' searches with the approximate index of Chroma, 'exact' compares the query with every embedding, see ExactSearchIndex
+DEFAULT_SEARCH_BACKEND = os.getenv('VECTOR_DB_SEARCH_BACKEND', 'hnsw')
+SEARCH_BACKENDS = ('hnsw', 'exact')
 
 class VectorDatabase:
-    def __init__(self, persist_directory="data"):
+    # hnsw_params sets the index parameters of a new collection, e.g. {"M": 32, "search_ef": 100, "construction_ef": 200}
+    def __init__(self, persist_directory="data", batch_size=DEFAULT_BATCH_SIZE, search_backend=DEFAULT_SEARCH_BACKEND, collection_name="all-my-documents", hnsw_params=None):
+        if search_backend not in SEARCH_BACKENDS:
+            raise Exception(f"Unknown search backend {search_backend}, expected one of {', '.join(SEARCH_BACKENDS)}")
+        # Chroma and the embedding model are only loaded when a database is opened, importing them takes seconds
+        import chromadb
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+        from embedding_cache import CachedEmbeddingFunction, get_embedding_cache
+
         # Setup Chroma with persistent storage
         self.client = chromadb.PersistentClient(
             path=persist_directory  # Directory where the data will be stored
         )
 
+        # Embeddings are computed here, one call per batch, so the time spent embedding can be reported
+        self.embedding_function = DefaultEmbeddingFunction()
+        # Unchanged texts are not embedded again, for upserts as well as for queries
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is not None:
+            self.embedding_function = CachedEmbeddingFunction(self.embedding_function, embedding_cache)
         # Create or get the collection. This will reuse the existing collection if it already exists.
-        self.collection = self.client.get_or_create_collection("all-my-documents")
+        # The HNSW parameters only apply when the collection is created
+        metadata = {f"hnsw:{key}": value for key, value in (hnsw_params or {}).items()} or None
+        self.collection = self.client.get_or_create_collection(collection_name, metadata=metadata, embedding_function=self.embedding_function)
+        self.batch_size = min(batch_size, self.client.get_max_batch_size())
+        self.search_backend = search_backend
+        self.exact_index = None
+        if search_backend == 'exact':
+            from exact_search import ExactSearchIndex
+            self.exact_index = ExactSearchIndex(self.collection)
 
     def add_documents_params(self, documents, metadatas, ids):
-        # Add docs to the collection. Can also update and delete. Row-based API coming soon!
-        self.collection.add(
-            documents=documents,  # we handle tokenization, embedding, and indexing automatically. You can skip that and add your own embeddings as well
-            metadatas=metadatas,  # filter on these!
-            ids=ids  # unique for each doc
+        self.upsert_documents([
+            {"document": document, "metadata": metadata, "id": id}
+            for document, metadata, id in zip(documents, metadatas, ids)
+        ])
+
+    def add_documents(self, docs: list):
+        self.upsert_documents(docs)
+
+    # Method to insert or replace documents by id, in size-bounded batches embedded together
+    # documents that already have an embedding key are not embedded again
+    # returns the timing of every batch
+    def upsert_documents(self, docs: list, batch_size=None):
+        batch_size = min(batch_size or self.batch_size, self.batch_size)
+        # A repeated id would fail the batch, the last version of a document wins
+        docs = list({doc['id']: doc for doc in docs}.values())
+        timings = []
+        for i in range(0, len(docs), batch_size):
+            batch = docs[i:i + batch_size]
+            documents = [doc['document'] for doc in batch]
+            started_at = time.perf_counter()
+            if all('embedding' in doc for doc in batch):
+                embeddings = [doc['embedding'] for doc in batch]
+            else:
+                embeddings = self.embedding_function(documents)
+            embedded_at = time.perf_counter()
+            ids = [doc['id'] for doc in batch]
+            metadatas = [doc['metadata'] for doc in batch]
+            self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            if self.exact_index is not None:
+                self.exact_index.upsert(ids, embeddings, metadatas, documents)
+            written_at = time.perf_counter()
+            timings.append({"documents": len(batch), "embed_seconds": embedded_at - started_at, "write_seconds": written_at - embedded_at})
+            print(f"Upserted batch {i // batch_size + 1}: {len(batch)} documents, embedded in {embedded_at - started_at:.2f}s, written in {written_at - embedded_at:.2f}s")
+        return timings
+
+    # Method to insert or replace markdown documents as one entry per section chunk
+    # chunk ids are <id>#<index>, their metadata keeps the document metadata with parent_id and chunk_index
+    def upsert_chunked_documents(self, docs: list):
+        chunks = []
+        for doc in docs:
+            texts = chunk_markdown(doc['document'])
+            for index, text in enumerate(texts):
+                metadata = dict(doc['metadata'], parent_id=doc['id'], chunk_index=index, chunk_count=len(texts))
+                chunks.append({"document": text, "metadata": metadata, "id": f"{doc['id']}#{index}"})
+
+        # Chroma merges the metadata of an upsert into the stored entry, so a label removed from a document would stay on its chunks
+        # the previous chunks and the entries stored before chunking are deleted first, unchanged chunks are not embedded again thanks to the embedding cache
+        self.delete_chunked_documents({doc['id'] for doc in docs})
+        return self.upsert_documents(chunks)
+
+    # Method to delete documents stored by upsert_chunked_documents, every chunk of them and any unchunked entry with the same id
+    def delete_chunked_documents(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        chunk_ids = self.collection.get(where={"parent_id": {"$in": ids}}, include=[])['ids']
+        self.delete_documents(chunk_ids + self.collection.get(ids=ids, include=[])['ids'])
+
+    # Method to delete entries by id, from the collection and from the exact search index
+    def delete_documents(self, ids):
+        if not ids:
+            return
+        self.collection.delete(ids=ids)
+        if self.exact_index is not None:
+            self.exact_index.delete(ids)
+
+    # Method to find the documents most similar to the query texts, chunk hits are grouped by parent document
+    # aggregate is 'max' to score a document by its closest chunk or 'mean' to average the distance of its hits
+    # the queries are either texts or already computed embeddings
+    def query_grouped(self, query_texts=None, n_results=2, aggregate='max', where=None, where_document=None, query_embeddings=None):
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+        return self.query_grouped_batch(
+            [query_texts] if query_texts is not None else None, n_results, aggregate, where, where_document,
+            [query_embeddings] if query_embeddings is not None else None
+        )[0]
+
+    # Method to run many grouped searches with a single query, each group of texts or embeddings is e.g. the chunks of one issue
+    # only the first MAX_QUERY_CHUNKS of a group are queried, so a long thread costs about as much as a short one
+    # returns one list of documents per group, the ids in exclude_ids (one per group, may be None) are left out of its results
+    # the results are the same as querying each group on its own with the excluded id filtered out by the where filter
+    def query_grouped_batch(self, query_text_groups=None, n_results=2, aggregate='max', where=None, where_document=None, query_embedding_groups=None, exclude_ids=None):
+        groups = query_text_groups if query_text_groups is not None else query_embedding_groups
+        groups = [list(group)[:MAX_QUERY_CHUNKS] for group in groups]
+        flat_queries = [query for group in groups for query in group]
+        if not flat_queries:
+            return [[] for _ in groups]
+        hits_per_query = n_results * CHUNK_QUERY_FACTOR
+        # Every chunk of an excluded document can be among the nearest hits of a query, e.g. the queries of an issue match its own chunks first
+        chunk_counts = self.get_chunk_counts([excluded_id for excluded_id in exclude_ids if excluded_id]) if exclude_ids else {}
+        rows = self.query_documents_batch(
+            flat_queries if query_text_groups is not None else None,
+            hits_per_query + max(chunk_counts.values(), default=0),
+            where, where_document,
+            flat_queries if query_text_groups is None else None
         )
+        list_results = []
+        offset = 0
+        for i, group in enumerate(groups):
+            excluded_id = exclude_ids[i] if exclude_ids else None
+            hits = [
+                hit
+                for query_hits in rows[offset:offset + len(group)]
+                for hit in [hit for hit in query_hits if (hit['metadata'] or {}).get('parent_id', hit['id']) != excluded_id][:hits_per_query]
+            ]
+            offset += len(group)
+            list_results.append(group_hits(hits, aggregate)[:n_results])
+        return list_results
 
+    # Method to count the stored chunks of documents, returns a dict of document id to number of chunks
+    def get_chunk_counts(self, ids):
+        ids = list(ids)
+        if not ids:
+            return {}
+        counts = {}
+        for metadata in self.collection.get(where={"parent_id": {"$in": ids}}, include=["metadatas"])['metadatas']:
+            counts[metadata['parent_id']] = counts.get(metadata['parent_id'], 0) + 1
+        return counts
 
-    def add_documents(self, docs: list):
-        # Extract documents, metadatas, and ids from the list of dictionaries
-        documents = [doc['document'] for doc in docs]
-        metadatas = [doc['metadata'] for doc in docs]
-        ids = [doc['id'] for doc in docs]
+    # Method to get the stored chunk embeddings of the documents matching a metadata filter, grouped by parent document in chunk order
+    def get_grouped_embeddings(self, where):
+        results = self.collection.get(where=where, include=["embeddings", "metadatas"])
+        chunks = {}
+        for id, metadata, embedding in zip(results['ids'], results['metadatas'], results['embeddings']):
+            parent_id = metadata.get('parent_id', id)
+            chunks.setdefault(parent_id, []).append((metadata.get('chunk_index', 0), embedding))
+        return {parent_id: [embedding for _, embedding in sorted(entries, key=lambda entry: entry[0])] for parent_id, entries in chunks.items()}
 
-        # Add docs to the collection
-        self.add_documents_params(documents, metadatas, ids)
+    # Method to run many queries at once, returns the hits of every query in the order of the queries
+    def query_documents_batch(self, query_texts=None, n_results=2, where=None, where_document=None, query_embeddings=None):
+        if self.exact_index is not None:
+            if query_embeddings is None:
+                query_embeddings = self.embedding_function(query_texts)
+            results = self.exact_index.query(query_embeddings, n_results, where, where_document)
+        else:
+            results = self.collection.query(
+                query_texts=query_texts,
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document
+            )
+        return [
+            [{"id": id, "metadata": metadata, "document": document, "distance": distance}
+             for id, metadata, document, distance in zip(ids, metadatas, documents, distances)]
+            for ids, metadatas, documents, distances in zip(results['ids'], results['metadatas'], results['documents'], results['distances'])
+        ]
 
-    def query_documents(self, query_texts, n_results=2):
+    # Method to search the documents most similar to a query, only the hits of the first query text are returned
+    # where filters on the metadata, see metadata_filter, and where_document on the text, e.g. {"$contains": "search_string"}
+    def query_documents(self, query_texts, n_results=2, where=None, where_document=None):
         # Query/search n most similar results. You can also .get by id
-        results = self.collection.query(
-            query_texts=query_texts,
-            n_results=n_results,
-            # where={"metadata_field": "is_equal_to_this"}, # optional filter
-            # where_document={"$contains": "search_string"}  # optional filter
-        )
-        print(results)
-        list_results = []   
-        for i in range(len(results['ids'][0])):
-            list_results.append({
-                "id": results['ids'][0][i],
-                "metadata": results['metadatas'][0][i], # Changed 'metadata' to 'metadatas'
-                "document": results['documents'][0][i], # Changed 'document' to 'documents
-                "distance": results['distances'][0][i] # Changed 'distance' to 'distances'
-            })
+        list_results = self.query_documents_batch(query_texts, n_results, where, where_document)[0]
+        print(list_results)
         return list_results
 
+# Function to group chunk hits by parent document, sorted from the most to the least similar document
+# aggregate is 'max' to score a document by its closest chunk or 'mean' to average the distance of its hits
+def group_hits(hits, aggregate='max'):
+    groups = {}
+    for hit in hits:
+        parent_id = (hit['metadata'] or {}).get('parent_id', hit['id'])
+        group = groups.setdefault(parent_id, dict(hit, id=parent_id, distances=[]))
+        group['distances'].append(hit['distance'])
+        if hit['distance'] < group['distance']:
+            group.update(metadata=hit['metadata'], document=hit['document'], distance=hit['distance'])
+
+    list_results = []
+    for group in groups.values():
+        distances = group.pop('distances')
+        group['hits'] = len(distances)
+        if aggregate == 'mean':
+            group['distance'] = sum(distances) / len(distances)
+        list_results.append(group)
+    list_results.sort(key=lambda result: result['distance'])
+    return list_results
+
+# Function to split a markdown document into chunks along its sections, the description and each comment
+# sections longer than chunk_size are split on line breaks with overlap, and every chunk keeps the document title
+def chunk_markdown(content, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    overlap = min(overlap, chunk_size // 2)
+    first_line = content.split('\n', 1)[0]
+    title = first_line + '\n' if first_line.startswith('# ') else ''
+    chunks = []
+    for section in SECTION_PATTERN.split(content):
+        if not section.strip():
+            continue
+        start = 0
+        while True:
+            end = min(start + chunk_size, len(section))
+            if end < len(section):
+                # Prefer ending the chunk on a line break, as long as it moves past the overlap
+                line_break = section.rfind('\n', start + overlap + 1, end)
+                if line_break != -1:
+                    end = line_break + 1
+            text = section[start:end]
+            chunks.append(text if text.startswith(title) else title + text)
+            if end == len(section):
+                break
+            start = end - overlap
+    return chunks or [content]
+
+# Function to get the metadata key flagging a label, metadata values cannot be lists so every label is its own key
+def label_key(name):
+    return f'label:{name}'
+
+# Function to convert an ISO 8601 date or a datetime into a Unix timestamp, so dates can be compared in filters
+def timestamp(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if len(value) == 10:
+        value += 'T00:00:00Z'
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
+# Function to build the where filter of a query, None values are not filtered on and every condition must match
+# labels are all required, created_after and created_before bound the creation date, exclude drops exact metadata values
+def metadata_filter(repo=None, state=None, labels=None, created_after=None, created_before=None, source=None, exclude=None, parent_id=None, parent_ids=None):
+    conditions = []
+    state = state.lower() if state and state.lower() != 'all' else None
+    for key, value in (('source', source), ('repo', repo), ('state', state), ('parent_id', parent_id)):
+        if value:
+            conditions.append({key: value})
+    if parent_ids:
+        conditions.append({'parent_id': {'$in': list(parent_ids)}})
+    for name in labels or []:
+        conditions.append({label_key(name): True})
+    if created_after:
+        conditions.append({'created_at_ts': {'$gte': timestamp(created_after)}})
+    if created_before:
+        conditions.append({'created_at_ts': {'$lte': timestamp(created_before)}})
+    for key, value in (exclude or {}).items():
+        conditions.append({key: {'$ne': value}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
 # Example usage
 if __name__ == "__main__":
     vector_db = VectorDatabase()
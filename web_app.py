@@ -1,11 +1,14 @@
+import json
+import os
 from code_assistant import call_agent, load_predefined_prompts
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
+from webhook_worker import get_webhook_worker, verify_signature
 
 # Define the input model for the POST request
 class InputModel(BaseModel):
@@ -47,5 +50,17 @@ def process_text(input: InputModel):
     result = process_input(input.text)
     return {"result": result}
 
+# Define the endpoint receiving GitHub webhooks, the events are applied by a background worker
+@app.post("/webhook/github", status_code=202)
+async def github_webhook(request: Request):
+    body = await request.body()
+    if not verify_signature(os.getenv('GITHUB_WEBHOOK_SECRET'), body, request.headers.get('X-Hub-Signature-256')):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return {"result": "pong"}
+    queued = get_webhook_worker().submit(event, json.loads(body))
+    return {"result": "queued" if queued else "ignored"}
+
 # Run the FastAPI app with Uvicorn
 uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
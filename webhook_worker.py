@@ -0,0 +1,129 @@
+import hashlib
+import hmac
+import os
+import queue
+import threading
+from dotenv import load_dotenv
+from issue_documenter import IssueDocumenter
+from rate_limiter import bulk_priority
+
+# Webhook events that update the local documents and indexes
+ISSUE_EVENTS = ('issues', 'issue_comment')
+PROJECT_ITEM_EVENT = 'projects_v2_item'
+# Project item actions after which the item is no longer on the board
+REMOVED_ITEM_ACTIONS = ('deleted', 'archived')
+# Issue actions after which the issue is no longer in the repository
+REMOVED_ISSUE_ACTIONS = ('deleted', 'transferred')
+
+
+# Function to check the X-Hub-Signature-256 header GitHub computes with the webhook secret
+def verify_signature(secret, body, signature):
+    if not secret or not signature or not signature.startswith('sha256='):
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+# Background worker applying webhook events to the issue documents, the project index and the vector database
+# events for the same issue or project item that arrive while one is waiting are handled once
+class WebhookWorker:
+    def __init__(self, github_token):
+        self.github_token = github_token
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='github-webhook-worker', daemon=True)
+        self.thread.start()
+
+    # Method to queue an event, returns False when it is not one the worker handles
+    def submit(self, event, payload):
+        task = self.make_task(event, payload)
+        if task is None:
+            return False
+        with self.lock:
+            if task in self.pending:
+                return True
+            self.pending.add(task)
+        self.queue.put(task)
+        return True
+
+    # Method to reduce an event to the work it needs, a hashable tuple so duplicates can be dropped
+    def make_task(self, event, payload):
+        action = payload.get('action')
+        if event in ISSUE_EVENTS:
+            issue = payload['issue']
+            # Comments on pull requests arrive as issue_comment events
+            if 'pull_request' in issue:
+                return None
+            repository = payload['repository']
+            if event == 'issues' and action in REMOVED_ISSUE_ACTIONS:
+                return ('issue_removed', repository['owner']['login'], repository['name'], issue['number'], issue['html_url'])
+            # A deleted comment is not visible to the incremental update, the document is rebuilt
+            incremental = not (event == 'issue_comment' and action == 'deleted')
+            # Comments do not change what the project boards show of an issue
+            update_boards = event == 'issues'
+            return ('issue', repository['owner']['login'], repository['name'], issue['number'], incremental, update_boards)
+        if event == PROJECT_ITEM_EVENT:
+            item = payload['projects_v2_item']
+            if item.get('content_type') != 'Issue':
+                return None
+            return ('project_item', item['project_node_id'], item['node_id'], action in REMOVED_ITEM_ACTIONS)
+        return None
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            with self.lock:
+                self.pending.discard(task)
+            try:
+                # Leave the rate limit budget to the agent
+                with bulk_priority():
+                    self.handle(task)
+            except Exception as e:
+                print(f'Could not apply webhook task {task}: {e}')
+            finally:
+                self.queue.task_done()
+
+    def handle(self, task):
+        if task[0] == 'issue':
+            _, repo_owner, repo_name, issue_number, incremental, update_boards = task
+            # The cached reads of the issue may be older than the event, even when they are still fresh
+            documenter = IssueDocumenter(self.github_token, repo_owner, repo_name, issue_number, revalidate=True)
+            documenter.document_issue(incremental=incremental)
+            if update_boards:
+                # Read again rather than taken from the payload, events can arrive out of order
+                issue = documenter.fetch_issue()
+                if issue:
+                    documenter.update_project_items_for_issue(issue)
+            print(f'Webhook updated issue {repo_owner}/{repo_name}#{issue_number}')
+        elif task[0] == 'issue_removed':
+            _, repo_owner, repo_name, issue_number, url = task
+            documenter = IssueDocumenter(self.github_token, repo_owner, repo_name, issue_number)
+            documenter.remove_issue_document()
+            documenter.project_index.delete_issue_items(url)
+            print(f'Webhook removed issue {repo_owner}/{repo_name}#{issue_number}')
+        elif task[0] == 'project_item':
+            _, project_id, item_id, removed = task
+            documenter = IssueDocumenter(self.github_token, None, None)
+            # Only the boards already synced into the index are kept up to date
+            if not documenter.project_index.has_project(project_id):
+                return
+            if removed:
+                documenter.project_index.delete_items([item_id])
+            else:
+                documenter.refresh_project_items(project_id, [item_id])
+            print(f'Webhook updated project item {item_id}')
+
+
+# Shared worker, started on the first event
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_webhook_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            load_dotenv()
+            _worker = WebhookWorker(os.getenv('GITHUB_TOKEN'))
+        return _worker